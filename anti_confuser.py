@@ -87,7 +87,7 @@ def w_object(obj: Any, f: TextIOBase) -> None:
         f.write(b'f')
         f.write(struct.pack('B', len(s)))
         f.write(s)
-    elif isinstance(obj, bytes):
+    elif isinstance(obj, (bytes, memoryview)):
         f.write(b's')
         f.write(struct.pack('<i', len(obj)))
         f.write(obj)
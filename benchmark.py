@@ -0,0 +1,137 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import nls_cipher
+from compression import POLICIES
+from crypto import decrypt_data
+from mcpk import pack_mcpk
+from mcs_marshal import McsMarshal
+
+VERSION_TAGS = {99: 1, 111: 2, 97: 3, 77: 4}
+
+def _best_time(func, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def _collect_files(paths: list) -> list:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, filenames in os.walk(path):
+                for filename in filenames:
+                    files.append(os.path.join(root, filename))
+        elif os.path.isfile(path):
+            files.append(path)
+        else:
+            print(f"[!] {path} not found, skipping")
+    return files
+
+def bench_parser(paths: list, repeat: int = 3) -> None:
+    # version -> [files, bytes, recursive seconds, iterative seconds]
+    totals = {}
+    for path in _collect_files(paths):
+        with open(path, 'rb') as f:
+            data = decrypt_data(f.read())
+        if not data or data[0] not in VERSION_TAGS:
+            continue
+        try:
+            recursive = _best_time(lambda: McsMarshal(data).r_object_recursive(), repeat)
+            iterative = _best_time(lambda: McsMarshal(data).r_object(), repeat)
+        except Exception as e:
+            print(f"[!] Failed to parse {path}: {e}")
+            continue
+        entry = totals.setdefault(VERSION_TAGS[data[0]], [0, 0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += len(data)
+        entry[2] += recursive
+        entry[3] += iterative
+
+    if not totals:
+        print("[!] No parsable .mcs files found")
+        return
+    print(f"{'Variant':<8}{'Files':>8}{'Bytes':>12}{'Recursive(s)':>15}{'Iterative(s)':>15}{'Speedup':>10}")
+    for version in sorted(totals):
+        files, size, recursive, iterative = totals[version]
+        speedup = recursive / iterative if iterative else 0.0
+        print(f"{'V' + str(version):<8}{files:>8}{size:>12}{recursive:>15.4f}{iterative:>15.4f}{speedup:>9.2f}x")
+
+def bench_pack(input_dir: str, policies: list = None) -> None:
+    policies = policies or list(POLICIES)
+    print(f"{'Policy':<10}{'Time(s)':>10}{'Size':>14}{'Ratio':>8}")
+    raw_size = sum(os.path.getsize(path) for path in _collect_files([input_dir]))
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in policies:
+            if name not in POLICIES:
+                print(f"[!] Unknown policy {name}, skipping")
+                continue
+            output = os.path.join(tmp, name + ".mcpk")
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                pack_mcpk(input_dir, output, policy=POLICIES[name])
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(output)
+            ratio = size / raw_size if raw_size else 0.0
+            print(f"{name:<10}{elapsed:>10.3f}{size:>14}{ratio:>8.3f}")
+
+def bench_decrypt(size_mib: int, workers: int = None) -> None:
+    workers = workers or os.cpu_count() or 1
+    size = size_mib << 20
+    data = os.urandom(size)
+    cipher = nls_cipher.NlsCipher()
+    checkpoints = cipher.schedule._checkpoints
+    loaded = cipher.schedule._loaded_checkpoints
+    print(f"{'Mode':<18}{'Time(s)':>10}")
+    with tempfile.TemporaryDirectory() as tmp:
+        # keep the user's checkpoint cache out of the cold run
+        cache = os.path.join(tmp, "checkpoints.json")
+        saved, saved_loaded = dict(checkpoints), dict(loaded)
+        try:
+            loaded.clear()
+            checkpoints.clear()
+            start = time.perf_counter()
+            cipher.decrypt(data)
+            print(f"{'serial':<18}{time.perf_counter() - start:>10.3f}")
+            checkpoints.clear()
+            start = time.perf_counter()
+            for offset in range(0, size, -(-size // workers)):
+                cipher.state_at(offset)
+            walk = time.perf_counter() - start
+            print(f"{'shard state walk':<18}{walk:>10.3f}")
+            checkpoints.clear()
+            start = time.perf_counter()
+            cipher.decrypt_parallel(data, workers, cache)
+            print(f"{'parallel, cold':<18}{time.perf_counter() - start:>10.3f}")
+            start = time.perf_counter()
+            cipher.decrypt_parallel(data, workers, cache)
+            print(f"{'parallel, cached':<18}{time.perf_counter() - start:>10.3f}")
+        finally:
+            checkpoints.clear()
+            checkpoints.update(saved)
+            loaded.clear()
+            loaded.update(saved_loaded)
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ("parser", "pack", "decrypt"):
+        print("Usage: python benchmark.py parser <mcs_file_or_folder> [...]")
+        print("       python benchmark.py pack <input_dir> [policy ...]")
+        print("       python benchmark.py decrypt <size_mib> [workers]")
+        return
+    if sys.argv[1] == "parser":
+        bench_parser(sys.argv[2:])
+    elif sys.argv[1] == "pack":
+        bench_pack(sys.argv[2], sys.argv[3:])
+    elif sys.argv[1] == "decrypt":
+        bench_decrypt(int(sys.argv[2]), int(sys.argv[3]) if len(sys.argv) > 3 else None)
+
+if __name__ == "__main__":
+    main()
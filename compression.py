@@ -0,0 +1,86 @@
+import os
+import zlib
+
+# Formats that are compressed already, deflate rarely gains anything on them
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.ogg', '.mp3', '.mp4', '.webp', '.ktx', '.pvr', '.zip')
+
+def is_zlib_header(data) -> bool:
+    """
+    True for any valid zlib stream header, whatever window size, level and
+    strategy it was written with (a preset dictionary is not supported).
+    """
+    if len(data) < 2:
+        return False
+    cmf, flg = data[0], data[1]
+    return (cmf & 0x0F) == 8 and (cmf >> 4) <= 7 and not flg & 0x20 and ((cmf << 8) | flg) % 31 == 0
+
+class CompressionPolicy:
+    """
+    How files are deflated when packing or encrypting. levels maps file
+    extensions to zlib levels; files with an extension in store_extensions,
+    or whose compressed size is above store_ratio of the original, are kept
+    uncompressed where the container allows it. Without those, every entry
+    is deflated like zlib.compress does.
+    """
+    def __init__(self, level: int = zlib.Z_DEFAULT_COMPRESSION, levels: dict = None,
+                 store_extensions: tuple = (), store_ratio: float = None, wbits: int = zlib.MAX_WBITS,
+                 mem_level: int = zlib.DEF_MEM_LEVEL, strategy: int = zlib.Z_DEFAULT_STRATEGY):
+        if not 9 <= wbits <= 15:
+            # the game only reads zlib streams, not raw deflate or gzip
+            raise ValueError(f"wbits must be between 9 and 15, got {wbits}")
+        if not 1 <= mem_level <= 9:
+            raise ValueError(f"mem_level must be between 1 and 9, got {mem_level}")
+        self.level = level
+        self.levels = {ext.lower(): lvl for ext, lvl in (levels or {}).items()}
+        self.store_extensions = tuple(ext.lower() for ext in store_extensions)
+        self.store_ratio = store_ratio
+        self.wbits = wbits
+        self.mem_level = mem_level
+        self.strategy = strategy
+
+    def level_for(self, name: str) -> int:
+        return self.levels.get(os.path.splitext(name)[1].lower(), self.level)
+
+    def compressobj(self, name: str = ""):
+        return zlib.compressobj(self.level_for(name), zlib.DEFLATED, self.wbits, self.mem_level, self.strategy)
+
+    def deflate(self, data, name: str = "") -> bytes:
+        compressor = self.compressobj(name)
+        return compressor.compress(data) + compressor.flush()
+
+    def should_store(self, name: str) -> bool:
+        return name.lower().endswith(self.store_extensions) if self.store_extensions else False
+
+    def compress_entry(self, data, name: str = "") -> bytes:
+        """
+        Data as it goes into an MCPK entry. Stored entries are returned as
+        is, the reader tells them apart by c_size == u_size.
+        """
+        if self.should_store(name):
+            return data
+        c_data = self.deflate(data, name)
+        if len(c_data) == len(data) or (self.store_ratio is not None and len(c_data) > len(data) * self.store_ratio):
+            return data
+        return c_data
+
+    def to_dict(self) -> dict:
+        return {
+            "level": self.level,
+            "levels": self.levels,
+            "store_extensions": list(self.store_extensions),
+            "store_ratio": self.store_ratio,
+            "wbits": self.wbits,
+            "mem_level": self.mem_level,
+            "strategy": self.strategy,
+        }
+
+# Same output as plain zlib.compress, what pack_mcpk always used
+DEFAULT_POLICY = CompressionPolicy()
+
+POLICIES = {
+    "default": DEFAULT_POLICY,
+    # dev builds: fastest deflate, skip formats that are compressed already
+    "fast": CompressionPolicy(level=1, store_extensions=STORED_EXTENSIONS, store_ratio=0.95),
+    # release builds: smallest output
+    "size": CompressionPolicy(level=9, mem_level=9, store_ratio=0.99),
+}
@@ -1,11 +1,34 @@
+import tempfile
 import zlib
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Iterator
+
+from compression import CompressionPolicy, is_zlib_header
 from nls_cipher import NlsCipher
 
-def encrypt_data(origin_content: bytes, content_type: int = 1) -> bytes:
+CHUNK_SIZE = 1 << 16
+
+# The first 130 bytes of the reversed script are XORed with 0x9C
+_XOR_9C = bytes(b ^ 0x9C for b in range(256))
+
+def _deflate_script(data: bytes, policy: CompressionPolicy) -> bytes:
+    if policy is None:
+        return zlib.compress(data, level=9)
+    if policy.wbits != zlib.MAX_WBITS:
+        # the 0x78 header byte is what identifies both script variants
+        raise ValueError("scripts must be compressed with wbits 15")
+    return policy.deflate(data)
+
+def encrypt_data(origin_content: bytes, content_type: int = 1, policy: CompressionPolicy = None) -> bytes:
+    """
+    policy sets how the content is deflated, level 9 when unset. Scripts are
+    always deflated, store options of the policy do not apply.
+    """
     if content_type == 2:
         # For redirect.mcs type
-        zlib_content = zlib.compress(origin_content, level=9)
+        zlib_content = _deflate_script(origin_content, policy)
         mcpk = b"MCPK"
         header = bytearray(zlib_content[:4])
         for i in range(4):
@@ -14,15 +37,22 @@ def encrypt_data(origin_content: bytes, content_type: int = 1) -> bytes:
         return zlib_content
     elif content_type == 1:
         wrapped = origin_content[::-1]
-        final_content = bytes([b ^ 0x9c for b in wrapped[:130]]) + wrapped[130:]
-        zlib_content = zlib.compress(final_content, level=9)
+        final_content = wrapped[:130].translate(_XOR_9C) + wrapped[130:]
+        zlib_content = _deflate_script(final_content, policy)
+        # encrypted scripts are recognised by E5 1F, the encrypted 78 DA header,
+        # the level bits of the header do not affect decompression
+        zlib_content = b'\x78\xDA' + zlib_content[2:]
         cipher = NlsCipher()
         encrypted = cipher.encrypt(zlib_content)
         return encrypted
     else:
         return origin_content
 
-def decrypt_data(origin_content: bytes) -> bytes:
+def decrypt_data(origin_content: bytes, workers: int = None) -> bytes:
+    """
+    With workers set, encrypted content larger than PARALLEL_THRESHOLD is
+    decrypted in a process pool of that size.
+    """
     zlib_content = b""
     if origin_content[0] == 0x35:
         # match redirect.mcs
@@ -34,22 +64,26 @@ def decrypt_data(origin_content: bytes) -> bytes:
     elif origin_content[:2] == b'\xE5\x1F':
         # match encrypted mcs
         cipher = NlsCipher()
-        zlib_content = cipher.decrypt(origin_content)
+        if workers:
+            zlib_content = cipher.decrypt_parallel(origin_content, workers)
+        else:
+            zlib_content = cipher.decrypt(origin_content)
     else:
         return origin_content
     
     if len(zlib_content) > 2:
         h1, h2 = zlib_content[0], zlib_content[1]
         
-        if h1 == 0x78 and h2 in [0x01, 0x9C, 0xDA]:
+        if is_zlib_header(zlib_content):
             try:
                 final_content = zlib.decompress(zlib_content)
                 
                 # Inspect Decompressed Content
                 if origin_content[:2] == b'\xE5\x1F':
-                    final_content = bytes([b ^ 0x9C for b in final_content[:130]]) + final_content[130:]
-                    # Reverse the content
+                    # Reverse the content, the XORed head ends up at the tail
                     final_content = final_content[::-1]
+                    split = max(len(final_content) - 130, 0)
+                    final_content = final_content[:split] + final_content[split:].translate(_XOR_9C)
                 return final_content
             except zlib.error as e:
                 print(f"[!] Zlib Decompression failed: {e}")
@@ -58,4 +92,145 @@ def decrypt_data(origin_content: bytes) -> bytes:
                 return zlib_content
         else:
             print("[!] Unknown header (Not Zlib). Saving raw decrypted.")
-            return zlib_content
\ No newline at end of file
+            return zlib_content
+
+def decrypt_head(origin_content: bytes, size: int) -> bytes:
+    """
+    Return at most the first size bytes decrypt_data would produce. Redirect
+    scripts are only decompressed as far as needed; encrypted scripts are
+    stored reversed, so their whole stream is inflated while keeping just a
+    window of its tail.
+    """
+    if size <= 0:
+        # a max_length of 0 would make zlib return everything
+        return b""
+    if origin_content[:1] == b'\x35':
+        mcpk = b"MCPK"
+        header = bytearray(origin_content[:4])
+        for i in range(4):
+            header[i] ^= mcpk[i]
+        decompressor = zlib.decompressobj()
+        head = decompressor.decompress(bytes(header), size)
+        if len(head) >= size:
+            return head[:size]
+        head += decompressor.decompress(origin_content[4:], size - len(head))
+        return head
+    elif origin_content[:2] != b'\xE5\x1F':
+        return origin_content[:size]
+
+    decompressor = zlib.decompressobj()
+    # output chunks covering the last size bytes, joined once at the end
+    parts = deque()
+    kept = 0
+    total = 0
+    chunk = NlsCipher().decrypt(origin_content)
+    while True:
+        data = decompressor.decompress(chunk, CHUNK_SIZE) if chunk else decompressor.flush()
+        if data:
+            parts.append(data)
+            kept += len(data)
+            total += len(data)
+            while kept - len(parts[0]) >= size:
+                kept -= len(parts.popleft())
+        if not chunk:
+            break
+        chunk = decompressor.unconsumed_tail
+    tail = b"".join(parts)[-size:]
+
+    # undo the 0x9C XOR on the part of the original head inside the window
+    head = bytearray(tail)
+    xored = 130 - (total - len(head))
+    if xored > 0:
+        head[:xored] = head[:xored].translate(_XOR_9C)
+    head.reverse()
+    return bytes(head)
+
+def _read_chunks(src: BinaryIO, chunk_size: int) -> Iterator[bytes]:
+    # Read the next chunk in the background while the current one is processed
+    with ThreadPoolExecutor(max_workers=1) as reader:
+        pending = reader.submit(src.read, chunk_size)
+        while True:
+            chunk = pending.result()
+            if not chunk:
+                return
+            pending = reader.submit(src.read, chunk_size)
+            yield chunk
+
+def _write_reversed(spool: BinaryIO, size: int, dst: BinaryIO, chunk_size: int) -> None:
+    # Copy spool to dst back to front, undoing the 0x9C XOR on the original head
+    end = size
+    while end > 0:
+        start = max(end - chunk_size, 0)
+        spool.seek(start)
+        block = bytearray(spool.read(end - start))
+        if start < 130:
+            head = min(130, end) - start
+            block[:head] = block[:head].translate(_XOR_9C)
+        block.reverse()
+        dst.write(block)
+        end = start
+
+def decrypt_stream(src: BinaryIO, dst: BinaryIO, chunk_size: int = CHUNK_SIZE) -> None:
+    """
+    Streaming variant of decrypt_data, reads src and writes the result to
+    dst with memory bounded by chunk_size. Encrypted scripts are reversed
+    after decompression, their output is spooled to a temporary file first.
+    """
+    chunks = _read_chunks(src, chunk_size)
+    # the format is known from the first 4 bytes, short reads may split them
+    first = b""
+    for chunk in chunks:
+        first += chunk
+        if len(first) >= 4:
+            break
+    if first[:1] == b'\x35':
+        # match redirect.mcs
+        mcpk = b"MCPK"
+        header = bytearray(first[:4])
+        for i in range(len(header)):
+            header[i] ^= mcpk[i]
+        first = bytes(header) + first[4:]
+        transform = None
+        encrypted = False
+    elif first[:2] == b'\xE5\x1F':
+        # match encrypted mcs
+        transform = NlsCipher().decryptor().update
+        first = transform(first)
+        encrypted = True
+    else:
+        dst.write(first)
+        for chunk in chunks:
+            dst.write(chunk)
+        return
+
+    if not is_zlib_header(first):
+        print("[!] Unknown header (Not Zlib). Saving raw decrypted.")
+        dst.write(first)
+        for chunk in chunks:
+            dst.write(transform(chunk) if transform else chunk)
+        return
+
+    out = tempfile.TemporaryFile() if encrypted else dst
+    size = 0
+    decompressor = zlib.decompressobj()
+    try:
+        chunk = first
+        while chunk is not None:
+            while chunk:
+                data = decompressor.decompress(chunk, chunk_size)
+                out.write(data)
+                size += len(data)
+                chunk = decompressor.unconsumed_tail
+            chunk = next(chunks, None)
+            if chunk is not None and transform:
+                chunk = transform(chunk)
+        data = decompressor.flush()
+        out.write(data)
+        size += len(data)
+        if encrypted:
+            _write_reversed(out, size, dst, chunk_size)
+    except zlib.error as e:
+        print(f"[!] Zlib Decompression failed: {e}")
+    finally:
+        if encrypted:
+            out.close()
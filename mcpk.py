@@ -2,10 +2,29 @@ import struct
 import zlib
 import json
 import os
+import io
+import hashlib
+import mmap
+import sys
+import tempfile
+import argparse
+
+from array import array
+from bisect import bisect_left
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from fnmatch import fnmatchcase
+from functools import lru_cache
+
+from compression import DEFAULT_POLICY, POLICIES, CompressionPolicy, is_zlib_header
+from name_dict import NameDictionary
 
 MAGIC1, MAGIC2 = 0x267B0B11, 0xBDEB77DE
 MAGIC3, MAGIC4, MAGIC5 = 0x02040801, 0x7D7EBBDE, 0x00804021
 H1_INIT, H2_INIT, ROT_INIT = 933775118, 2002301995, 0xF4FA8928
+HASH_CACHE_SIZE = 1 << 16
+MANIFEST_SUFFIX = ".manifest.json"
 
 def _update_h1_h2(h1: int, h2: int, rot: int, chunk: int) -> tuple[int, int]:
     x1, x2 = (h1 ^ chunk) & 0xFFFFFFFF, (h2 ^ chunk) & 0xFFFFFFFF
@@ -56,7 +75,7 @@ def _finalize_h1_h2(h1: int, h2: int, rot: int) -> int:
     
     return (part1 ^ part2) & 0xFFFFFFFF
 
-def _hash_directory(data: str | bytes) -> int:
+def _hash_directory_reference(data: str | bytes) -> int:
     if isinstance(data, str): data = data.encode('ascii')
     
     last_slash = data.rfind(b'/')
@@ -85,7 +104,7 @@ def _hash_directory(data: str | bytes) -> int:
     
     return _finalize_h1_h2(h1, h2, rot)
 
-def _hash_file(data: str | bytes) -> int:
+def _hash_file_reference(data: str | bytes) -> int:
     if isinstance(data, str): data = data.encode('ascii')
     h1, h2, rot = H1_INIT, H2_INIT, ROT_INIT
     length = len(data)
@@ -107,7 +126,657 @@ def _hash_file(data: str | bytes) -> int:
         h1, h2 = _update_h1_h2(h1, h2, rot, chunk)
     return _finalize_h1_h2(h1, h2, rot)
 
-def pack_mcpk(input_dir: str, output_file: str) -> None:
+# rot ^ MAGIC1 after n rotations of ROT_INIT, the rotation repeats every 32 chunks
+_ROT_KEYS = tuple((((ROT_INIT << n) | (ROT_INIT >> (32 - n))) & 0xFFFFFFFF) ^ MAGIC1 for n in range(32))
+_ZERO_PAD = (b"", b"\x00\x00\x00", b"\x00\x00", b"\x00")
+
+def _hash_chunks(data: bytes) -> int:
+    # Fused _update_h1_h2 over the zero padded little-endian chunks of data
+    keys = _ROT_KEYS
+    h1, h2 = H1_INIT, H2_INIT
+    n = 0
+    for chunk, in struct.iter_unpack('<I', data + _ZERO_PAD[len(data) & 3]):
+        n += 1
+        k = keys[n & 31]
+        x1, x2 = h1 ^ chunk, h2 ^ chunk
+        p1 = x1 * (((k + x2) & MAGIC2) | MAGIC3)
+        hi = p1 >> 32
+        s1 = hi + (hi != 0) + (p1 & 0xFFFFFFFF)
+        h1 = (s1 + (s1 >> 32)) & 0xFFFFFFFF
+        p2 = x2 * (((k + x1) & MAGIC4) | MAGIC5)
+        s2 = (p2 & 0xFFFFFFFF) + 2 * (p2 >> 32)
+        h2 = (s2 + 2 * (s2 >> 32)) & 0xFFFFFFFF
+
+    # _finalize_h1_h2 with the rotated keys taken from the table
+    k1, k2 = keys[(n + 1) & 31], keys[(n + 2) & 31]
+    f1, f2 = h1 ^ 0x9BE74448, h2 ^ 0x9BE74448
+    p1 = f1 * (((k1 + f2) & MAGIC2) | MAGIC3)
+    hi = p1 >> 32
+    s1 = hi + (hi != 0) + (p1 & 0xFFFFFFFF)
+    y1 = ((s1 & 0xFFFFFFFF) + (s1 >> 32)) ^ 0x66F42C48
+    p2 = f2 * (((k1 + f1) & MAGIC4) | MAGIC5)
+    s2 = (p2 & 0xFFFFFFFF) + 2 * (p2 >> 32)
+    y2 = ((s2 + 2 * (s2 >> 32)) & 0xFFFFFFFF) ^ 0x66F42C48
+    p3 = y1 * (((k2 + y2) & MAGIC2) | MAGIC3)
+    hi = (p3 >> 32) & 0xFFFFFFFF
+    s3 = hi + (hi != 0) + (p3 & 0xFFFFFFFF)
+    part1 = ((s3 & 0xFFFFFFFF) + (s3 >> 32)) & 0xFFFFFFFF
+    p4 = y2 * (((k2 + y1) & MAGIC4) | MAGIC5)
+    s4 = (p4 & 0xFFFFFFFF) + 2 * (p4 >> 32) + (p4 >> 63)
+    part2 = ((s4 & 0xFFFFFFFF) + 2 * (s4 >> 32)) & 0xFFFFFFFF
+    return part1 ^ part2
+
+def _hash_directory(data: str | bytes) -> int:
+    # bytearray and memoryview are not hashable, the cache needs bytes
+    if isinstance(data, (bytearray, memoryview)): data = bytes(data)
+    return _hash_directory_cached(data)
+
+@lru_cache(maxsize=HASH_CACHE_SIZE)
+def _hash_directory_cached(data: str | bytes) -> int:
+    if isinstance(data, str): data = data.encode('ascii')
+    last_slash = data.rfind(b'/')
+    if last_slash <= 0:
+        return 0
+    return _hash_chunks(data[:last_slash])
+
+def _hash_file(data: str | bytes) -> int:
+    if isinstance(data, (bytearray, memoryview)): data = bytes(data)
+    return _hash_file_cached(data)
+
+@lru_cache(maxsize=HASH_CACHE_SIZE)
+def _hash_file_cached(data: str | bytes) -> int:
+    if isinstance(data, str): data = data.encode('ascii')
+    end = data.find(b'\x00')
+    if end == 0 or not data:
+        return _hash_chunks(b"")
+    if end != -1:
+        # keep the terminator, a name ending on a chunk boundary hashes one more zero chunk
+        data = data[:end + 1]
+    return _hash_chunks(data)
+
+def hash_paths(paths: list) -> list:
+    """
+    Hash many relative paths at once, returns (d_hash, f_hash) per path.
+    Each distinct directory and file name is only hashed once.
+    """
+    dir_hashes = {}
+    file_hashes = {}
+    result = []
+    for path in paths:
+        if isinstance(path, str): path = path.encode('ascii')
+        last_slash = path.rfind(b'/')
+        directory = path[:last_slash] if last_slash != -1 else b""
+        name = path[last_slash + 1:]
+        d_hash = dir_hashes.get(directory)
+        if d_hash is None:
+            d_hash = dir_hashes[directory] = _hash_chunks(directory) if directory else 0
+        f_hash = file_hashes.get(name)
+        if f_hash is None:
+            f_hash = file_hashes[name] = _hash_file(name)
+        result.append((d_hash, f_hash))
+    return result
+
+CONTENTS_JSON_HASH = _hash_file("contents.json")
+REDIRECT_MCS_HASH = _hash_file("redirect.mcs")
+
+class PathHashStore:
+    """
+    Relative path -> (d_hash, f_hash) map persisted as JSON, so repeated
+    packs and unpacks of the same paths skip hashing.
+    """
+    def __init__(self, path: str = None):
+        self.path = path
+        self.paths = {}
+        self.dirty = False
+        self._reverse = None
+        if path and os.path.isfile(path):
+            with open(path, 'r') as f:
+                self.paths = {rel_path: tuple(hashes) for rel_path, hashes in json.load(f).items()}
+
+    def hash_path(self, rel_path: str) -> tuple[int, int]:
+        hashes = self.paths.get(rel_path)
+        if hashes is None:
+            hashes = (_hash_directory(rel_path), _hash_file(rel_path.rsplit('/', 1)[-1]))
+            self.paths[rel_path] = hashes
+            if self._reverse is not None:
+                self._reverse.setdefault(hashes, rel_path)
+            self.dirty = True
+        return hashes
+
+    def path_for(self, d_hash: int, f_hash: int) -> str | None:
+        if self._reverse is None:
+            self._reverse = {}
+            for rel_path, hashes in self.paths.items():
+                self._reverse.setdefault(hashes, rel_path)
+        return self._reverse.get((d_hash, f_hash))
+
+    def save(self, path: str = None) -> None:
+        path = path or self.path
+        if path is None or (not self.dirty and path == self.path):
+            return
+        with open(path, 'w') as f:
+            json.dump(self.paths, f)
+        self.dirty = False
+
+McpkEntry = namedtuple('McpkEntry', 'd_hash f_hash offset c_size u_size data')
+
+def _is_compressed(data, u_size: int) -> bool:
+    # entries stored as is have c_size == u_size
+    return len(data) != u_size and is_zlib_header(data)
+
+class McpkEntryStream(io.RawIOBase):
+    # Decompresses one entry on demand while it is read
+    def __init__(self, data: memoryview, compressed: bool):
+        self._data = data
+        self._pos = 0
+        self._pending = b""
+        self._decompressor = zlib.decompressobj() if compressed else None
+
+    def readable(self) -> bool:
+        return True
+
+    def _next(self, size: int) -> bytes:
+        if self._decompressor is None:
+            chunk = self._data[self._pos:self._pos + size]
+            self._pos += len(chunk)
+            return chunk.tobytes()
+        decompressor = self._decompressor
+        while True:
+            if decompressor.unconsumed_tail:
+                out = decompressor.decompress(decompressor.unconsumed_tail, size)
+            elif self._pos < len(self._data) and not decompressor.eof:
+                chunk = self._data[self._pos:self._pos + (1 << 16)]
+                self._pos += len(chunk)
+                out = decompressor.decompress(chunk, size)
+            else:
+                return decompressor.flush()
+            if out:
+                return out
+
+    def readinto(self, b) -> int:
+        if not self._pending:
+            self._pending = self._next(max(len(b), 1 << 16))
+        n = min(len(b), len(self._pending))
+        b[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+def _path_key(path) -> tuple[int, int]:
+    # path is a relative path or a (d_hash, f_hash) pair
+    if isinstance(path, tuple):
+        return path
+    path = path.replace('\\', '/')
+    return _hash_directory(path), _hash_file(path.rsplit('/', 1)[-1])
+
+def _signed_int32(n: int) -> int:
+    return n if n < 0x80000000 else n - 0x100000000
+
+class McpkArchive:
+    """
+    Random access to a .mcpk through mmap. The directory and index tables
+    stay in the mapping as int32 views; hashes are sorted as signed int32,
+    so an entry is found with two binary searches and opening costs no more
+    than reading the header. Entry data is returned as memoryviews of the
+    mapping, so single files can be read without extracting the pack.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self._map)
+        self._tables = []
+        if self._map[:4] != b'MCPK':
+            self.close()
+            raise ValueError(f"{path} is not a MCPK file")
+
+        self.dir_table_offset, self.index_base, _ = struct.unpack_from('<III', self._map, 12)
+        dir_count = (self.index_base - self.dir_table_offset) // 12
+        dir_end = self.dir_table_offset + dir_count * 12
+        self.dir_hashes = self._column(self._ints(self.dir_table_offset, dir_end, 'i'), 0, 3)
+        dir_table = self._ints(self.dir_table_offset, dir_end, 'I')
+        self.dir_offsets = self._column(dir_table, 1, 3)
+        self.dir_counts = self._column(dir_table, 2, 3)
+
+        self.entry_count = max((offset // 16 + count for offset, count in zip(self.dir_offsets, self.dir_counts)), default=0)
+        self.data_base = self.index_base + self.entry_count * 16
+        self.f_hashes = self._column(self._ints(self.index_base, self.data_base, 'i'), 0, 4)
+        index = self._ints(self.index_base, self.data_base, 'I')
+        self.offsets = self._column(index, 1, 4)
+        self.c_sizes = self._column(index, 2, 4)
+        self.u_sizes = self._column(index, 3, 4)
+
+    def _ints(self, start: int, end: int, code: str):
+        # little-endian int32 table as a zero-copy view, a swapped copy elsewhere
+        if sys.byteorder == 'little':
+            table = self.view[start:end].cast(code)
+            self._tables.append(table)
+            return table
+        table = array(code, self.view[start:end])
+        table.byteswap()
+        return table
+
+    def _column(self, table, first: int, step: int):
+        # every view derived from the mapping is kept so close() can release it
+        column = table[first::step]
+        if isinstance(column, memoryview):
+            self._tables.append(column)
+        return column
+
+    def _dir_index(self, d_hash: int) -> int:
+        key = _signed_int32(d_hash)
+        i = bisect_left(self.dir_hashes, key)
+        if i < len(self.dir_hashes) and self.dir_hashes[i] == key:
+            return i
+        return -1
+
+    def _entry_index(self, d_hash: int, f_hash: int) -> int:
+        d = self._dir_index(d_hash)
+        if d < 0:
+            return -1
+        lo = self.dir_offsets[d] // 16
+        hi = lo + self.dir_counts[d]
+        key = _signed_int32(f_hash)
+        i = bisect_left(self.f_hashes, key, lo, hi)
+        if i < hi and self.f_hashes[i] == key:
+            return i
+        return -1
+
+    def _find(self, path) -> int:
+        i = self._entry_index(*_path_key(path))
+        if i < 0:
+            raise KeyError(path)
+        return i
+
+    def __contains__(self, path) -> bool:
+        return self._entry_index(*_path_key(path)) >= 0
+
+    def __len__(self) -> int:
+        return self.entry_count
+
+    def _data(self, i: int) -> memoryview:
+        start = self.data_base + self.offsets[i]
+        return self.view[start:start + self.c_sizes[i]]
+
+    def raw(self, path) -> memoryview:
+        return self._data(self._find(path))
+
+    def read(self, path) -> bytes:
+        i = self._find(path)
+        data = self._data(i)
+        if _is_compressed(data, self.u_sizes[i]):
+            return zlib.decompress(data)
+        return data.tobytes()
+
+    def open(self, path) -> io.BufferedReader:
+        i = self._find(path)
+        data = self._data(i)
+        return io.BufferedReader(McpkEntryStream(data, _is_compressed(data, self.u_sizes[i])))
+
+    def _entry_keys(self):
+        # (d_hash, f_hash, index) of every entry, only the tables are touched
+        for d_hash, offset, count in zip(self.dir_hashes, self.dir_offsets, self.dir_counts):
+            d_hash &= 0xFFFFFFFF
+            start = offset // 16
+            for i in range(start, start + count):
+                yield d_hash, self.f_hashes[i] & 0xFFFFFFFF, i
+
+    def iter_entries(self):
+        for d_hash, f_hash, i in self._entry_keys():
+            yield McpkEntry(d_hash, f_hash, self.offsets[i], self.c_sizes[i], self.u_sizes[i], self._data(i))
+
+    def close(self) -> None:
+        if self._map is None:
+            return
+        for table in reversed(self._tables):
+            table.release()
+        self._tables = []
+        self.view.release()
+        try:
+            self._map.close()
+        except BufferError:
+            # entry views returned by raw() or iter_entries() are still held
+            # by the caller, the mapping is closed once they are gone
+            pass
+        self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def _compress_entry(source, name: str, is_script_mcp: bool, policy: CompressionPolicy) -> tuple[bytes, int, str]:
+    # source is the data of a virtual file or the path of a file to read,
+    # returns the stored data, u_size and the sha1 of the file for manifests
+    if isinstance(source, bytes):
+        u_data = source
+    else:
+        with open(source, 'rb') as f_in:
+            u_data = f_in.read()
+    digest = hashlib.sha1(u_data).hexdigest()
+    if is_script_mcp:
+        return u_data, 0x7FFFFFFF, digest
+    return policy.compress_entry(u_data, name), len(u_data), digest
+
+def _compress_entries(sources: list, is_script_mcp: bool, policy: CompressionPolicy, workers: int = None,
+                      threads: bool = False):
+    """
+    Yield (c_data, u_size, sha1) for each (source, name) in order. With workers set the
+    files are compressed in a process pool, or a thread pool with threads
+    (zlib releases the GIL), keeping a bounded window of them in flight.
+    """
+    if not workers or workers <= 1:
+        for source, name in sources:
+            yield _compress_entry(source, name, is_script_mcp, policy)
+        return
+
+    executor = ThreadPoolExecutor if threads else ProcessPoolExecutor
+    with executor(max_workers=workers) as pool:
+        pending = deque()
+        for source, name in sources:
+            pending.append(pool.submit(_compress_entry, source, name, is_script_mcp, policy))
+            if len(pending) >= workers * 4:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+MCPK_HEADER_SIZE = 57
+WRITE_CHUNK_SIZE = 1 << 16
+
+class McpkWriter:
+    """
+    Writes a .mcpk entry by entry. add_file compresses a stream in chunks of
+    chunk_size, so memory does not grow with file size; index metadata is kept
+    in arrays and the header, directory table and index are written in one
+    pass on close. When entry_count and dir_count are known up front the data
+    is written in place after room left for the tables, otherwise it is
+    spooled to a temporary file and copied behind them on close.
+    With dedup, entries whose data has the same sha1 as an earlier one point
+    at its data instead of storing it again.
+    """
+    def __init__(self, output_file: str, policy: CompressionPolicy = None, script: bool = False,
+                 entry_count: int = None, dir_count: int = None, chunk_size: int = WRITE_CHUNK_SIZE,
+                 dedup: bool = False):
+        self.output_file = output_file
+        self.policy = policy or DEFAULT_POLICY
+        self.script = script
+        self.chunk_size = chunk_size
+        self.dedup = dedup
+        self.duplicates = 0
+        self.bytes_saved = 0
+        self._digests = {}
+        self.d_hashes = array('I')
+        self.f_hashes = array('I')
+        self.offsets = array('I')
+        self.c_sizes = array('I')
+        self.u_sizes = array('I')
+        self._file = open(output_file, 'wb+')
+        self._reserved = None
+        if entry_count is not None and dir_count is not None:
+            self._reserved = (entry_count, dir_count)
+            self._out = self._file
+            self._out.seek(MCPK_HEADER_SIZE + dir_count * 12 + entry_count * 16)
+        else:
+            self._out = tempfile.TemporaryFile()
+        self._data_start = self._out.tell()
+
+    def _record(self, path, offset: int, c_size: int, u_size: int, digest: str = None) -> None:
+        d_hash, f_hash = _path_key(path)
+        if self.dedup and digest is not None:
+            self._digests.setdefault(digest, len(self.f_hashes))
+        self.d_hashes.append(d_hash)
+        self.f_hashes.append(f_hash)
+        self.offsets.append(offset)
+        self.c_sizes.append(c_size)
+        self.u_sizes.append(u_size)
+
+    def has_digest(self, digest: str) -> bool:
+        return digest in self._digests
+
+    def add_duplicate(self, path, digest: str) -> None:
+        # add an entry sharing the data of the earlier entry with this sha1
+        i = self._digests[digest]
+        self._record(path, self.offsets[i], self.c_sizes[i], self.u_sizes[i])
+        self.duplicates += 1
+        self.bytes_saved += self.c_sizes[i]
+
+    def add_file(self, path, stream, name: str = None) -> str:
+        """
+        Add an entry read from the binary stream. path is the relative path
+        inside the package or a (d_hash, f_hash) pair, name (default path)
+        picks the policy by extension. Returns the sha1 of the file data.
+        """
+        name = name or (path if isinstance(path, str) else "")
+        out = self._out
+        start = out.tell()
+        digest = hashlib.sha1()
+        store = self.script or self.policy.should_store(name)
+        compressor = None if store else self.policy.compressobj(name)
+        stream_start = stream.tell() if compressor and stream.seekable() else None
+        # a stream that cannot be rewound is kept aside in case it has to be stored
+        raw = tempfile.TemporaryFile() if compressor and stream_start is None else None
+        try:
+            u_size = 0
+            while True:
+                chunk = stream.read(self.chunk_size)
+                if not chunk:
+                    break
+                u_size += len(chunk)
+                digest.update(chunk)
+                if raw is not None:
+                    raw.write(chunk)
+                out.write(compressor.compress(chunk) if compressor else chunk)
+            if compressor:
+                out.write(compressor.flush())
+            c_size = out.tell() - start
+
+            ratio = self.policy.store_ratio
+            if compressor and (c_size == u_size or (ratio is not None and c_size > u_size * ratio)):
+                # not worth compressing, store the data as is; readers take
+                # c_size == u_size as stored, so deflated data never keeps it
+                source = raw if raw is not None else stream
+                source.seek(0 if raw is not None else stream_start)
+                out.seek(start)
+                out.truncate()
+                for chunk in iter(lambda: source.read(self.chunk_size), b""):
+                    out.write(chunk)
+                c_size = u_size
+        finally:
+            if raw is not None:
+                raw.close()
+        digest = digest.hexdigest()
+        if self.dedup and digest in self._digests:
+            out.seek(start)
+            out.truncate()
+            self.add_duplicate(path, digest)
+        else:
+            self._record(path, start - self._data_start, c_size, 0x7FFFFFFF if self.script else u_size, digest)
+        return digest
+
+    def add_data(self, path, c_data, u_size: int, digest: str = None) -> None:
+        # add an entry that is compressed already
+        start = self._out.tell()
+        self._out.write(c_data)
+        self._record(path, start - self._data_start, len(c_data), u_size, digest)
+
+    def copy_entry(self, path, src, src_offset: int, c_size: int, u_size: int, digest: str = None) -> None:
+        # add an entry copied verbatim from c_size bytes of src at src_offset
+        start = self._out.tell()
+        _copy_range(src, src_offset, self._out, c_size)
+        self._record(path, start - self._data_start, c_size, u_size, digest)
+
+    def close(self) -> None:
+        if self._file is None:
+            return
+        try:
+            self._finish()
+        finally:
+            if self._out is not self._file:
+                self._out.close()
+            self._file.close()
+            self._file = None
+
+    def _finish(self) -> None:
+        count = len(self.f_hashes)
+        order = sorted(range(count), key=lambda i: (_signed_int32(self.d_hashes[i]), _signed_int32(self.f_hashes[i])))
+        dir_table = bytearray()
+        index = bytearray(count * 16)
+        last_d_hash = None
+        dir_start = 0
+        for n, i in enumerate(order):
+            d_hash = self.d_hashes[i]
+            if d_hash != last_d_hash:
+                if last_d_hash is not None:
+                    dir_table += struct.pack('<III', last_d_hash, dir_start * 16, n - dir_start)
+                last_d_hash, dir_start = d_hash, n
+            elif self.f_hashes[i] == self.f_hashes[order[n - 1]]:
+                raise ValueError(f"duplicate entry {d_hash:08X}/{self.f_hashes[i]:08X}")
+            struct.pack_into('<IIII', index, n * 16, self.f_hashes[i], self.offsets[i], self.c_sizes[i], self.u_sizes[i])
+        if last_d_hash is not None:
+            dir_table += struct.pack('<III', last_d_hash, dir_start * 16, count - dir_start)
+
+        dir_count = len(dir_table) // 12
+        if self._reserved is not None and self._reserved != (count, dir_count):
+            raise ValueError(f"reserved {self._reserved[0]} entries in {self._reserved[1]} directories, "
+                             f"got {count} in {dir_count}")
+        index_base = MCPK_HEADER_SIZE + len(dir_table)
+        data_base = index_base + len(index)
+
+        header = bytearray(MCPK_HEADER_SIZE)
+        header[0:4] = b'MCPK'
+        header[4:12] = bytes.fromhex("000000009653DA41")
+        header[24:34] = b'minecraft\0'
+        struct.pack_into('<III', header, 12, MCPK_HEADER_SIZE, index_base, data_base)
+        struct.pack_into('<I', header, 48, len(dir_table))
+
+        if self._out is self._file:
+            data_end = self._out.tell()
+        else:
+            data_end = data_base + self._out.tell()
+        self._file.seek(0)
+        self._file.write(header + dir_table + index)
+        if self._out is not self._file:
+            _copy_range(self._out, 0, self._file, data_end - data_base)
+        self._file.seek(data_end)
+        self._file.write(b'\x00' * 129)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._file is not None:
+            if self._out is not self._file:
+                self._out.close()
+            self._file.close()
+            self._file = None
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f_in:
+        for chunk in iter(lambda: f_in.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _load_manifest(mcpk_path: str) -> dict | None:
+    try:
+        with open(mcpk_path + MANIFEST_SUFFIX, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _copy_range(src, src_offset: int, dst, size: int) -> None:
+    # Copy size bytes of src at src_offset to the current position of dst
+    dst.flush()
+    dst_offset = dst.tell()
+    copied = 0
+    if hasattr(os, 'copy_file_range'):
+        try:
+            while copied < size:
+                n = os.copy_file_range(src.fileno(), dst.fileno(), size - copied,
+                                       src_offset + copied, dst_offset + copied)
+                if n == 0:
+                    break
+                copied += n
+        except OSError:
+            pass
+    dst.seek(dst_offset + copied)
+    if copied < size:
+        src.seek(src_offset + copied)
+        remaining = size - copied
+        while remaining > 0:
+            chunk = src.read(min(remaining, 1 << 20))
+            if not chunk:
+                raise EOFError("base archive is truncated")
+            dst.write(chunk)
+            remaining -= len(chunk)
+    else:
+        dst.seek(dst_offset + size)
+
+def _plan_reuse(nodes: list, base_archive: McpkArchive, base_manifest: dict, manifest: dict) -> dict:
+    """
+    Find nodes whose file is unchanged since the base pack, by size and
+    mtime or else by content hash. Returns node number -> base entry index
+    and records every file in manifest.
+    """
+    reused = {}
+    base_files = base_manifest.get("files", {}) if base_manifest else {}
+    for n, node in enumerate(nodes):
+        known = base_files.get(node.get('rel_path'))
+        if known is None:
+            continue
+        st = os.stat(node['full_path'])
+        size, mtime_ns, digest = known
+        if size != st.st_size:
+            continue
+        if mtime_ns != st.st_mtime_ns and digest != _file_digest(node['full_path']):
+            continue
+        i = base_archive._entry_index(_hash_directory(node['rel_path']), node['f_hash'])
+        if i < 0:
+            continue
+        reused[n] = i
+        manifest[node['rel_path']] = [st.st_size, st.st_mtime_ns, digest]
+    return reused
+
+def _plan_dedup(nodes: list, files_manifest: dict) -> tuple[dict, set]:
+    """
+    Content hashes of the files that may have a duplicate, those sharing
+    their size with another file, taken from the manifest where possible.
+    Returns node number -> sha1 and the node numbers repeating an earlier one.
+    """
+    by_size = {}
+    for n, node in enumerate(nodes):
+        if 'full_path' in node:
+            by_size.setdefault(os.path.getsize(node['full_path']), []).append(n)
+    digests = {}
+    for group in by_size.values():
+        if len(group) < 2:
+            continue
+        for n in group:
+            known = files_manifest.get(nodes[n]['rel_path'])
+            digests[n] = known[2] if known else _file_digest(nodes[n]['full_path'])
+    seen = set()
+    duplicates = set()
+    for n in sorted(digests):
+        if digests[n] in seen:
+            duplicates.add(n)
+        seen.add(digests[n])
+    return digests, duplicates
+
+def pack_mcpk(input_dir: str, output_file: str, hash_store: PathHashStore = None, workers: int = None,
+              threads: bool = False, base: str = None, manifest: bool = False,
+              policy: CompressionPolicy = None, dedup: bool = False) -> None:
+    """
+    policy chooses how entries are compressed, DEFAULT_POLICY when unset.
+    With dedup, files with identical content are stored once and their
+    index entries share the data.
+    With base set to an earlier .mcpk of the same tree, entries whose files
+    are unchanged according to its sidecar manifest are copied verbatim and
+    only changed files are compressed again. A manifest is written next to
+    output_file when manifest or base is set.
+    """
     if input_dir is None or input_dir.strip() == "":
         print("[!] Input directory is empty")
         return
@@ -118,6 +787,7 @@ def pack_mcpk(input_dir: str, output_file: str) -> None:
         print("[!] Output file path is empty")
         return
 
+    policy = policy or DEFAULT_POLICY
     dir_groups = {}
     all_rel_paths = []
     has_contents_json = False
@@ -125,22 +795,27 @@ def pack_mcpk(input_dir: str, output_file: str) -> None:
     
     print(f"[+] Scanning files in {input_dir}...")
     for root, _, filenames in os.walk(input_dir):
+        # every file below root shares its directory hash
+        rel_root = os.path.relpath(root, input_dir).replace('\\', '/')
+        root_hash = 0 if rel_root == '.' else _hash_directory(rel_root + '/')
         for filename in filenames:
             full_path = os.path.join(root, filename)
             rel_path = os.path.relpath(full_path, input_dir).replace('\\', '/')
             all_rel_paths.append(rel_path)
             
-            d_hash = _hash_directory(rel_path)
-            f_hash = _hash_file(filename)
+            if hash_store is not None:
+                d_hash, f_hash = hash_store.hash_path(rel_path)
+            else:
+                d_hash, f_hash = root_hash, _hash_file(filename)
                 
-            if d_hash == 0 and f_hash == _hash_file("contents.json"):
+            if d_hash == 0 and f_hash == CONTENTS_JSON_HASH:
                 has_contents_json = True
-            if d_hash == 0 and f_hash == _hash_file("redirect.mcs"):
+            if d_hash == 0 and f_hash == REDIRECT_MCS_HASH:
                 is_script_mcp = True
                 
             if d_hash not in dir_groups:
                 dir_groups[d_hash] = []
-            dir_groups[d_hash].append({'f_hash': f_hash, 'full_path': full_path})
+            dir_groups[d_hash].append({'d_hash': d_hash, 'f_hash': f_hash, 'full_path': full_path, 'rel_path': rel_path})
 
     if not is_script_mcp and not has_contents_json:
         print("[+] contents.json not found, auto-generating...")
@@ -148,83 +823,188 @@ def pack_mcpk(input_dir: str, output_file: str) -> None:
         v_data = json.dumps({"content": contents_list}, indent=4).encode('utf-8')
         if 0 not in dir_groups:
             dir_groups[0] = []
-        dir_groups[0].append({'f_hash': _hash_file("contents.json"), 'virtual_data': v_data})
+        dir_groups[0].append({'d_hash': 0, 'f_hash': CONTENTS_JSON_HASH, 'virtual_data': v_data})
 
     # use signed int32 for sorting
-    def signed_int32(n):
-        return n if n < 0x80000000 else n - 0x100000000
-
-    sorted_d_hashes = sorted(dir_groups.keys(), key=signed_int32)
-    header_size = 57
-    dir_table_size = len(sorted_d_hashes) * 12
-    index_base_offset = header_size + dir_table_size
-    
+    sorted_d_hashes = sorted(dir_groups.keys(), key=_signed_int32)
     num_total_files = sum(len(dir_groups[dh]) for dh in sorted_d_hashes)
     
+    nodes = []
+    for d_hash in sorted_d_hashes:
+        nodes.extend(sorted(dir_groups[d_hash], key=lambda x: _signed_int32(x['f_hash'])))
+
+    base_archive = None
+    reused = {}
+    files_manifest = {}
+    target_file = output_file
+    if base:
+        base_manifest = _load_manifest(base)
+        if (base_manifest is None or base_manifest.get("script") != is_script_mcp
+                or base_manifest.get("compression") != policy.to_dict()):
+            print(f"[!] No usable manifest for {base}, packing all files")
+        else:
+            base_archive = McpkArchive(base)
+            reused = _plan_reuse(nodes, base_archive, base_manifest, files_manifest)
+            print(f"[+] Reusing {len(reused)} unchanged entries from {base}")
+            if os.path.abspath(base) == os.path.abspath(output_file):
+                target_file = output_file + ".tmp"
+
+    digests = {}
+    duplicates = set()
+    if dedup:
+        digests, duplicates = _plan_dedup(nodes, files_manifest)
+
     print(f"[+] Building {output_file}...")
-    with open(output_file, 'wb+') as f_out:
-        # prepare header and structures
-        header = bytearray(57)
-        header[0:4] = b'MCPK'
-        header[4:12] = bytes.fromhex("000000009653DA41")
-        header[24:34] = b'minecraft\0'
-        header[34:48] = bytes.fromhex("0000000000000000000000000000")
-        f_out.write(header)
-        
-        # write directory table
-        curr_idx_rel_offset = 0
-        for d_hash in sorted_d_hashes:
-            f_out.write(struct.pack('<III', d_hash, curr_idx_rel_offset, len(dir_groups[d_hash])))
-            curr_idx_rel_offset += len(dir_groups[d_hash]) * 16
-
-        # write index entries
-        index_entry_positions = []
-        for d_hash in sorted_d_hashes:
-            nodes = sorted(dir_groups[d_hash], key=lambda x: signed_int32(x['f_hash']))
-            for node in nodes:
-                index_entry_positions.append((f_out.tell(), node))
-                f_out.write(struct.pack('<IIII', node['f_hash'], 0, 0, 0))
-        
-        # write compressed data
-        data_base_offset = f_out.tell()
-        for pos, node in index_entry_positions:
-            f_offset = f_out.tell() - data_base_offset
-            if 'virtual_data' in node:
-                u_data = node['virtual_data']
-            else:
-                with open(node['full_path'], 'rb') as f_in:
-                    u_data = f_in.read()
-            
-            u_size = len(u_data)
-            if not is_script_mcp:
-                c_data = zlib.compress(u_data)
-            else:
-                u_size = 0x7FFFFFFF
-                c_data = u_data
-            c_size = len(c_data)
-                
-            f_out.write(c_data)
-            node['meta'] = (f_offset, c_size, u_size)
-        
-        # write index metadata
-        for pos, node in index_entry_positions:
-            f_out.seek(pos + 4)
-            f_out.write(struct.pack('<III', *node['meta']))
-        
-        # write header updates
-        f_out.seek(12)
-        f_out.write(struct.pack('<III', header_size, index_base_offset, data_base_offset))
-        
-        f_out.seek(48)
-        f_out.write(struct.pack('<I', dir_table_size))
-        
-        # write padding
-        f_out.seek(0, 2)
-        f_out.write(b'\x00' * 129)
+    try:
+        with McpkWriter(target_file, policy, is_script_mcp, len(nodes), len(sorted_d_hashes), dedup=dedup) as writer:
+            if workers and workers > 1:
+                sources = [(node['virtual_data'], "contents.json") if 'virtual_data' in node else (node['full_path'], node['full_path'])
+                           for n, node in enumerate(nodes) if n not in reused and n not in duplicates]
+                compressed = _compress_entries(sources, is_script_mcp, policy, workers, threads)
+            for n, node in enumerate(nodes):
+                key = (node['d_hash'], node['f_hash'])
+                digest = digests.get(n)
+                if n in duplicates:
+                    writer.add_duplicate(key, digest)
+                    st = os.stat(node['full_path'])
+                    files_manifest[node['rel_path']] = [st.st_size, st.st_mtime_ns, digest]
+                    continue
+                if n in reused:
+                    i = reused[n]
+                    writer.copy_entry(key, base_archive._file, base_archive.data_base + base_archive.offsets[i],
+                                      base_archive.c_sizes[i], base_archive.u_sizes[i], digest)
+                    continue
+                if workers and workers > 1:
+                    c_data, u_size, digest = next(compressed)
+                    writer.add_data(key, c_data, u_size, digest)
+                elif 'virtual_data' in node:
+                    digest = writer.add_file(key, io.BytesIO(node['virtual_data']), "contents.json")
+                else:
+                    with open(node['full_path'], 'rb') as f_in:
+                        digest = writer.add_file(key, f_in, node['full_path'])
+                if 'rel_path' in node:
+                    st = os.stat(node['full_path'])
+                    files_manifest[node['rel_path']] = [st.st_size, st.st_mtime_ns, digest]
 
+        if dedup:
+            print(f"[+] Deduplicated {writer.duplicates} entries, saved {writer.bytes_saved} bytes")
+        if base_archive is not None:
+            # the base has to be unmapped before it can be replaced on Windows
+            base_archive.close()
+            base_archive = None
+        if target_file != output_file:
+            os.replace(target_file, output_file)
+    finally:
+        if base_archive is not None:
+            base_archive.close()
+        if target_file != output_file and os.path.exists(target_file):
+            os.remove(target_file)
+    if manifest or base:
+        with open(output_file + MANIFEST_SUFFIX, 'w') as f:
+            json.dump({"script": is_script_mcp, "compression": policy.to_dict(), "files": files_manifest}, f)
+    if hash_store is not None:
+        hash_store.save()
     print(f"[+] Successfully packed {num_total_files} files in {len(sorted_d_hashes)} directories.")
 
-def unpack_mcpk(file_path: str, output_dir: str) -> None:
+EXTRACT_BATCH_SIZE = 256
+
+def _write_file(path: str, data, made: set) -> None:
+    directory = os.path.dirname(path)
+    if directory not in made:
+        os.makedirs(directory, exist_ok=True)
+        made.add(directory)
+    with open(path, 'wb') as out_f:
+        out_f.write(data)
+
+def _extract_listed(archive: McpkArchive, output_dir: str, task: tuple, made: set) -> str:
+    d_hash, i, norm_path, f_hash = task
+    c_data = archive._data(i)
+    out_path = os.path.join(output_dir, norm_path)
+    try:
+        if _is_compressed(c_data, archive.u_sizes[i]):
+            u_data = zlib.decompress(c_data)
+        else:
+            u_data = c_data
+        _write_file(out_path, u_data, made)
+        return f"[+] Extracted {norm_path} (d_hash={d_hash:08X}, f_hash={f_hash:08X})"
+    except Exception as e:
+        _write_file(out_path, c_data, made)
+        return f"[!] Failed to extract {norm_path}, save origin data (d_hash={d_hash:08X}, f_hash={f_hash:08X}): {e}"
+
+def _extract_hashed(archive: McpkArchive, output_dir: str, task: tuple, is_script_mcp: bool, made: set) -> str:
+    d_hash, i, known_path = task
+    f_hash = archive.f_hashes[i] & 0xFFFFFFFF
+    c_data = archive._data(i)
+    compressed = _is_compressed(c_data, archive.u_sizes[i])
+    out_dir = os.path.join(output_dir, f"{d_hash:08X}")
+    name = f"{f_hash:08X}"
+    try:
+        if known_path:
+            name = known_path
+            _write_file(os.path.join(output_dir, name), zlib.decompress(c_data) if compressed else c_data, made)
+        elif compressed:
+            _write_file(os.path.join(out_dir, name), zlib.decompress(c_data), made)
+        elif not is_script_mcp:
+            raise ValueError("not a zlib stream and no redirect.mcs in package")
+        else:
+            from mcs import decrypt_data
+            from anti_confuser import McsMarshal
+
+            # decrypt for get filename, only the root code object header is read
+            d_data = decrypt_data(c_data)
+            file_name = (McsMarshal(d_data).r_code_header(fields=('filename',)).get('filename') or b'').decode('utf-8')
+            if file_name == '':
+                _write_file(os.path.join(out_dir, name), c_data, made)
+            else:
+                name = file_name.replace('.py', '.mcs')
+                # write origin file data
+                _write_file(os.path.join(output_dir, name), c_data, made)
+        return f"[+] Extracted {name} (d_hash={d_hash:08X}, f_hash={f_hash:08X})"
+    except Exception as e:
+        _write_file(os.path.join(out_dir, name), c_data, made)
+        return f"[!] Failed to extract {name}, save origin data (d_hash={d_hash:08X}, f_hash={f_hash:08X}): {e}"
+
+def _extract_task(archive: McpkArchive, output_dir: str, task: tuple, listed: bool, is_script_mcp: bool, made: set) -> str:
+    if listed:
+        return _extract_listed(archive, output_dir, task, made)
+    return _extract_hashed(archive, output_dir, task, is_script_mcp, made)
+
+_worker_archive = None
+
+def _init_extract_worker(file_path: str) -> None:
+    global _worker_archive
+    _worker_archive = McpkArchive(file_path)
+
+def _extract_batch(output_dir: str, tasks: list, listed: bool, is_script_mcp: bool) -> list:
+    # Worker side of _extract_parallel, one batch holds entries of one directory
+    made = set()
+    return [_extract_task(_worker_archive, output_dir, task, listed, is_script_mcp, made) for task in tasks]
+
+def _extract_parallel(file_path: str, output_dir: str, tasks: list, listed: bool, is_script_mcp: bool, workers: int) -> None:
+    # batches hold entries of one directory, positions keep the log in plan order
+    groups = {}
+    for position, task in enumerate(tasks):
+        groups.setdefault(task[0], []).append(position)
+    batches = []
+    for group in groups.values():
+        for start in range(0, len(group), EXTRACT_BATCH_SIZE):
+            batches.append(group[start:start + EXTRACT_BATCH_SIZE])
+
+    lines = [None] * len(tasks)
+    printed = 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_extract_worker, initargs=(file_path,)) as pool:
+        futures = {pool.submit(_extract_batch, output_dir, [tasks[position] for position in batch], listed,
+                               is_script_mcp): batch for batch in batches}
+        for future in as_completed(futures):
+            for position, line in zip(futures[future], future.result()):
+                lines[position] = line
+            while printed < len(lines) and lines[printed] is not None:
+                print(lines[printed])
+                lines[printed] = True
+                printed += 1
+
+def unpack_mcpk(file_path: str, output_dir: str, hash_store: PathHashStore = None, name_dict: NameDictionary = None,
+                workers: int = None) -> None:
     if file_path is None or file_path.strip() == "":
         print("[!] Input file path is empty")
         return
@@ -236,68 +1016,27 @@ def unpack_mcpk(file_path: str, output_dir: str) -> None:
         return
 
     os.makedirs(output_dir, exist_ok=True)
-    with open(file_path, 'rb') as f:
-        header = f.read(57)
-        if header[:4] != b'MCPK':
-            print("[!] Not a MCPK file")
-            return
-
-        dir_table_offset = struct.unpack('<I', header[12:16])[0]
-        index_base_offset = struct.unpack('<I', header[16:20])[0]
-        
-        f.seek(dir_table_offset)
-        dir_count = (index_base_offset - dir_table_offset) // 12
-        dir_entries = []
-        max_index_rel_offset = 0
-        last_dir_files = 0
-        for _ in range(dir_count):
-            entry = struct.unpack('<III', f.read(12))
-            dir_entries.append(entry)
-            if entry[1] >= max_index_rel_offset:
-                max_index_rel_offset = entry[1]
-                last_dir_files = entry[2]
-        
-        data_base_offset = index_base_offset + max_index_rel_offset + last_dir_files * 16
-        print(f"[+] DirTable: {dir_table_offset}, IndexBase: {index_base_offset}, DataBase: {data_base_offset}")
+    try:
+        archive = McpkArchive(file_path)
+    except ValueError:
+        print("[!] Not a MCPK file")
+        return
+    with archive:
+        print(f"[+] DirTable: {archive.dir_table_offset}, IndexBase: {archive.index_base}, DataBase: {archive.data_base}")
         
-        dir_map = {
-            de[0]: {
-                "offset": de[1],
-                "count": de[2],
-                "files": {}
-            } for de in dir_entries}
-        del dir_entries
-        for d_hash, info in dir_map.items():
-            f.seek(index_base_offset + info["offset"])
-            for _ in range(info["count"]):
-                fe = struct.unpack('<IIII', f.read(16))
-                info["files"][fe[0]] = {
-                    "offset": fe[1],
-                    "c_size": fe[2],
-                    "u_size": fe[3]
-                }
         file_list_json = None
-        # with open("mcpk_debug_dirmap.json", 'w') as debug_f:
-        #     json.dump(dir_map, debug_f, indent=4)
 
-        contents_json_hash = _hash_file("contents.json")
-        redirect_mcs_hash = _hash_file("redirect.mcs")
+        contents_json_hash = CONTENTS_JSON_HASH
+        redirect_mcs_hash = REDIRECT_MCS_HASH
         print(f"[+] Checking for package type...")
         
         is_script_mcp = False
         contents_data = None
-        if dir_map[0]["files"].get(contents_json_hash):
-            f.seek(data_base_offset + dir_map[0]["files"][contents_json_hash]["offset"])
-            c_size = dir_map[0]["files"][contents_json_hash]["c_size"]
-            c_data = f.read(c_size)
-            head_magic = c_data[:2]
+        if (0, contents_json_hash) in archive:
             try:
-                if head_magic == b'\x78\x9C' or head_magic == b'\x78\xDA':
-                    contents_data = zlib.decompress(c_data)
-                else:
-                    contents_data = c_data
+                contents_data = archive.read((0, contents_json_hash))
             except:
-                contents_data = c_data
+                contents_data = archive.raw((0, contents_json_hash)).tobytes()
             
             with open(os.path.join(output_dir, "contents.json"), 'wb') as out_f:
                 out_f.write(contents_data)
@@ -316,14 +1055,11 @@ def unpack_mcpk(file_path: str, output_dir: str) -> None:
             except Exception as e:
                 print(f"[!] Failed to parse contents.json: {e}")
                 return
-        if dir_map[0]["files"].get(redirect_mcs_hash):
+        if (0, redirect_mcs_hash) in archive:
             from mcs import decrypt_data
-            from anti_confuser import McsMarshal
             
             is_script_mcp = True
-            f.seek(data_base_offset + dir_map[0]["files"][redirect_mcs_hash]["offset"])
-            c_size = dir_map[0]["files"][redirect_mcs_hash]["c_size"]
-            c_data = f.read(c_size)
+            c_data = archive.raw((0, redirect_mcs_hash)).tobytes()
             
             with open(os.path.join(output_dir, "redirect.mcs"), 'wb') as out_f:
                 try:
@@ -337,90 +1073,518 @@ def unpack_mcpk(file_path: str, output_dir: str) -> None:
         
         if contents_data is not None:
             del contents_data
+            tasks = []
             for file_item in files_to_extract:
                 file_path_str = file_item.get("path", "")
                 norm_path = file_path_str.replace('\\', '/')
                 
-                d_hash = _hash_directory(norm_path)
-                if '/' in norm_path:
-                    f_name = norm_path.rsplit('/', 1)[1]
+                if hash_store is not None:
+                    d_hash, f_hash = hash_store.hash_path(norm_path)
                 else:
-                    f_name = norm_path
-                f_hash = _hash_file(f_name)
+                    d_hash = _hash_directory(norm_path)
+                    if '/' in norm_path:
+                        f_name = norm_path.rsplit('/', 1)[1]
+                    else:
+                        f_name = norm_path
+                    f_hash = _hash_file(f_name)
                 
-                if d_hash not in dir_map:
+                if archive._dir_index(d_hash) < 0:
                     print(f"[!] Directory hash not found for {norm_path}, skipping.")
                     continue
-                file_info = dir_map[d_hash]["files"].get(f_hash)
-                if not file_info:
+                i = archive._entry_index(d_hash, f_hash)
+                if i < 0:
                     print(f"[!] File hash not found for {norm_path}, skipping.")
                     continue
-                
-                f.seek(data_base_offset + file_info["offset"])
-                c_size = file_info["c_size"]
-                u_size = file_info["u_size"]
-                c_data = f.read(c_size)
-                head_magic = c_data[:2]
-                try:
-                    if head_magic == b'\x78\x9C' or head_magic == b'\x78\xDA':
-                        u_data = zlib.decompress(c_data)
-                    else:
-                        u_data = c_data
-                    out_path = os.path.join(output_dir, norm_path)
-                    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-                    with open(out_path, 'wb') as out_f:
-                        out_f.write(u_data)
-                    print(f"[+] Extracted {norm_path} (d_hash={d_hash:08X}, f_hash={f_hash:08X})")
-                except Exception as e:
-                    print(f"[!] Failed to extract {norm_path}, save origin data (d_hash={d_hash:08X}, f_hash={f_hash:08X}): {e}")
-                    out_path = os.path.join(output_dir, norm_path)
-                    os.makedirs(os.path.dirname(out_path), exist_ok=True)
-                    with open(out_path, 'wb') as out_f:
-                        out_f.write(c_data)
+                tasks.append((d_hash, i, norm_path, f_hash))
         else:
-            for d_hash in dir_map:
-                out_dir = os.path.join(output_dir, f"{d_hash:08X}")
-                f.seek(index_base_offset + dir_map[d_hash]["offset"])
-                for _ in range(dir_map[d_hash]["count"]):
-                    fe = struct.unpack('<IIII', f.read(16))
-                    f_hash, f_offset, c_size, u_size = fe
-                    name = f"{f_hash:08X}"
-                    pos = f.tell()
-                    f.seek(data_base_offset + f_offset)
-                    c_data = f.read(c_size)
-                    head_magic = c_data[:2]
-                    try:
-                        if head_magic == b'\x78\x9C' or head_magic == b'\x78\xDA':
-                            u_data = zlib.decompress(c_data)
-                            with open(os.path.join(out_dir, name), 'wb') as out_f:
-                                out_f.write(u_data)
-                        else:
-                            # decrypt for get filename
-                            d_data = decrypt_data(c_data)
-                            parser = McsMarshal(d_data)
-                            root = parser.r_object()
-                            file_name = root.get('filename', b'').decode('utf-8')
-                            if file_name == '':
-                                os.makedirs(out_dir, exist_ok=True)
-                                with open(os.path.join(out_dir, name), 'wb') as out_f:
-                                    out_f.write(c_data)
-                            else:
-                                file_name = file_name.replace('.py', '.mcs')
-                                name = file_name
-                                target_path = os.path.join(output_dir, file_name)
-                                os.makedirs(os.path.dirname(target_path), exist_ok=True)
-                                # write origin file data
-                                with open(target_path, 'wb') as out_f:
-                                    out_f.write(c_data)
-                        print(f"[+] Extracted {name} (d_hash={d_hash:08X}, f_hash={f_hash:08X})")
-                    except Exception as e:
-                        print(f"[!] Failed to extract {name}, save origin data (d_hash={d_hash:08X}, f_hash={f_hash:08X}): {e}")
-                        os.makedirs(out_dir, exist_ok=True)
-                        with open(os.path.join(out_dir, name), 'wb') as out_f:
-                            out_f.write(c_data)
-                    f.seek(pos)
+            tasks = []
+            for d_hash, f_hash, i in archive._entry_keys():
+                # path known from an earlier run or the name dictionary, redirect.mcs is extracted above
+                known_path = None
+                if (d_hash, f_hash) != (0, redirect_mcs_hash):
+                    if hash_store is not None:
+                        known_path = hash_store.path_for(d_hash, f_hash)
+                    if known_path is None and name_dict is not None:
+                        known_path = name_dict.lookup(d_hash, f_hash)
+                tasks.append((d_hash, i, known_path))
+        listed = file_list_json is not None
+        if workers and workers > 1:
+            _extract_parallel(file_path, output_dir, tasks, listed, is_script_mcp, workers)
+        else:
+            made = set()
+            for task in tasks:
+                print(_extract_task(archive, output_dir, task, listed, is_script_mcp, made))
+    if hash_store is not None:
+        hash_store.save()
+
+def _entry_names(archive: McpkArchive, hash_store: PathHashStore = None, name_dict: NameDictionary = None,
+                 read_contents: bool = True) -> dict:
+    """
+    (d_hash, f_hash) -> relative path for every entry whose name is known,
+    from contents.json when the pack has one, then the hash store and the
+    name dictionary. Only the contents.json payload is read.
+    """
+    names = {}
+    if (0, CONTENTS_JSON_HASH) in archive:
+        names[(0, CONTENTS_JSON_HASH)] = "contents.json"
+    if (0, CONTENTS_JSON_HASH) in archive and read_contents:
+        try:
+            file_list_json = json.loads(archive.read((0, CONTENTS_JSON_HASH)).decode('utf-8'))
+            items = file_list_json.get("content", file_list_json) if isinstance(file_list_json, dict) else file_list_json
+        except Exception as e:
+            print(f"[!] Failed to parse contents.json: {e}")
+            items = []
+        for item in items if isinstance(items, list) else []:
+            norm_path = (item.get("path", "") if isinstance(item, dict) else "").replace('\\', '/')
+            if not norm_path:
+                continue
+            try:
+                names.setdefault(_path_key(norm_path), norm_path)
+            except UnicodeEncodeError:
+                pass
+    if (0, REDIRECT_MCS_HASH) in archive:
+        names[(0, REDIRECT_MCS_HASH)] = "redirect.mcs"
+    if hash_store is not None or name_dict is not None:
+        for d_hash, f_hash, _ in archive._entry_keys():
+            if (d_hash, f_hash) in names:
+                continue
+            known_path = hash_store.path_for(d_hash, f_hash) if hash_store is not None else None
+            if known_path is None and name_dict is not None:
+                known_path = name_dict.lookup(d_hash, f_hash)
+            if known_path is not None:
+                names[(d_hash, f_hash)] = known_path
+    return names
+
+def _glob_match(name: str, patterns: list) -> bool:
+    # '*' also crosses '/', so 'textures/*' and 'textures/**' select the whole subtree
+    return any(fnmatchcase(name, pattern.replace('\\', '/')) for pattern in patterns)
+
+def extract_mcpk(file_path: str, output_dir: str, include: list = None, exclude: list = None, paths: list = None,
+                 hashes: list = None, hash_store: PathHashStore = None, name_dict: NameDictionary = None,
+                 workers: int = None) -> int:
+    """
+    Extract only the selected entries: relative paths, (d_hash, f_hash)
+    pairs, and entries whose path matches one of the include globs and none
+    of the exclude globs. Entries are looked up in the index and only their
+    payloads are read. Globs match the real path when contents.json, the
+    hash store or the name dictionary knows it, "D_HASH/F_HASH" in hex
+    otherwise. Returns the number of entries extracted.
+    """
+    if not os.path.isfile(file_path):
+        print(f"[!] File {file_path} does not exist")
+        return 0
+    try:
+        archive = McpkArchive(file_path)
+    except ValueError:
+        print("[!] Not a MCPK file")
+        return 0
+    with archive:
+        names = None
+        selected = {}
+        for path in paths or []:
+            norm_path = path.replace('\\', '/')
+            d_hash, f_hash = hash_store.hash_path(norm_path) if hash_store is not None else _path_key(norm_path)
+            i = archive._entry_index(d_hash, f_hash)
+            if i < 0:
+                print(f"[!] {norm_path} not found, skipping.")
+                continue
+            selected[i] = (d_hash, i, norm_path, f_hash)
+        if hashes or include or exclude:
+            names = _entry_names(archive, hash_store, name_dict)
+        for d_hash, f_hash in hashes or []:
+            i = archive._entry_index(d_hash, f_hash)
+            if i < 0:
+                print(f"[!] Entry d_hash={d_hash:08X}, f_hash={f_hash:08X} not found, skipping.")
+                continue
+            selected[i] = (d_hash, i, names.get((d_hash, f_hash), f"{d_hash:08X}/{f_hash:08X}"), f_hash)
+        if include or exclude:
+            for d_hash, f_hash, i in archive._entry_keys():
+                name = names.get((d_hash, f_hash), f"{d_hash:08X}/{f_hash:08X}")
+                if include and not _glob_match(name, include):
+                    continue
+                if exclude and _glob_match(name, exclude):
+                    continue
+                selected.setdefault(i, (d_hash, i, name, f_hash))
+        if not selected:
+            print("[!] No entries selected")
+            return 0
+
+        os.makedirs(output_dir, exist_ok=True)
+        # index order is data order, so the payloads are read front to back
+        tasks = [selected[i] for i in sorted(selected)]
+        if workers and workers > 1:
+            _extract_parallel(file_path, output_dir, tasks, True, False, workers)
+        else:
+            made = set()
+            for task in tasks:
+                print(_extract_listed(archive, output_dir, task, made))
+    if hash_store is not None:
+        hash_store.save()
+    print(f"[+] Extracted {len(tasks)} of {len(archive)} entries")
+    return len(tasks)
+
+def _ratio(c_size: int, u_size: int) -> float | None:
+    # script packs store u_size 0x7FFFFFFF, the real size is unknown
+    if u_size == 0x7FFFFFFF or u_size == 0:
+        return None
+    return c_size / u_size
+
+def list_mcpk(file_path: str, hash_store: PathHashStore = None, name_dict: NameDictionary = None,
+              as_json: bool = False, read_contents: bool = True) -> list:
+    """
+    Print every entry's index fields, compression ratio and real path when
+    known, as a table or JSON. Only the header, directory table and index
+    are read, plus the contents.json payload unless read_contents is False.
+    """
+    try:
+        archive = McpkArchive(file_path)
+    except (OSError, ValueError) as e:
+        print(f"[!] {e}")
+        return []
+    with archive:
+        names = _entry_names(archive, hash_store, name_dict, read_contents)
+        entries = []
+        for d_hash, f_hash, i in archive._entry_keys():
+            c_size, u_size = archive.c_sizes[i], archive.u_sizes[i]
+            entries.append({
+                "d_hash": f"{d_hash:08X}",
+                "f_hash": f"{f_hash:08X}",
+                "offset": archive.offsets[i],
+                "c_size": c_size,
+                "u_size": u_size,
+                "ratio": _ratio(c_size, u_size),
+                "path": names.get((d_hash, f_hash)),
+            })
+    if as_json:
+        print(json.dumps(entries, indent=2))
+        return entries
+    print(f"{'D_HASH':8} {'F_HASH':8} {'OFFSET':>12} {'C_SIZE':>10} {'U_SIZE':>10} {'RATIO':>7}  PATH")
+    for entry in entries:
+        ratio = "-" if entry["ratio"] is None else f"{entry['ratio']:.1%}"
+        print(f"{entry['d_hash']:8} {entry['f_hash']:8} {entry['offset']:>12} {entry['c_size']:>10} "
+              f"{entry['u_size']:>10} {ratio:>7}  {entry['path'] or ''}")
+    return entries
+
+def stat_mcpk(file_path: str, as_json: bool = False) -> dict:
+    """
+    Print a summary of the archive layout and sizes, read from the header,
+    directory table and index only.
+    """
+    try:
+        archive = McpkArchive(file_path)
+    except (OSError, ValueError) as e:
+        print(f"[!] {e}")
+        return {}
+    with archive:
+        compressed = uncompressed = unknown_size = stored = 0
+        payloads = set()
+        for i in range(archive.entry_count):
+            c_size, u_size = archive.c_sizes[i], archive.u_sizes[i]
+            payloads.add((archive.offsets[i], c_size))
+            compressed += c_size
+            if u_size == 0x7FFFFFFF:
+                unknown_size += 1
+                continue
+            uncompressed += u_size
+            if c_size == u_size:
+                stored += 1
+        stats = {
+            "path": file_path,
+            "file_size": len(archive._map),
+            "dir_table_offset": archive.dir_table_offset,
+            "index_base": archive.index_base,
+            "data_base": archive.data_base,
+            "directories": len(archive.dir_hashes),
+            "entries": archive.entry_count,
+            "unique_payloads": len(payloads),
+            "stored_entries": stored,
+            "unknown_size_entries": unknown_size,
+            "package": "contents.json" if (0, CONTENTS_JSON_HASH) in archive
+                       else "redirect.mcs" if (0, REDIRECT_MCS_HASH) in archive else None,
+            "c_size_total": compressed,
+            "u_size_total": uncompressed,
+            "data_size": sum(c_size for _, c_size in payloads),
+        }
+    if as_json:
+        print(json.dumps(stats, indent=2))
+    else:
+        for key, value in stats.items():
+            print(f"[+] {key}: {value}")
+    return stats
+
+VERIFY_CHUNK_SIZE = 1 << 20
+
+def _verify_layout(file_path: str) -> tuple[list, bool]:
+    # Check the header and directory table before McpkArchive trusts them,
+    # the flag is False when the index cannot be read at all
+    problems = []
+    file_size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        header = f.read(MCPK_HEADER_SIZE)
+        if len(header) < MCPK_HEADER_SIZE or header[:4] != b'MCPK':
+            return ["not a MCPK file or header truncated"], False
+        dir_table_offset, index_base, data_base = struct.unpack_from('<III', header, 12)
+        dir_table_size, = struct.unpack_from('<I', header, 48)
+        if not MCPK_HEADER_SIZE <= dir_table_offset <= index_base <= file_size:
+            return [f"header offsets out of order or past the end of the file: dir table {dir_table_offset}, "
+                    f"index {index_base}, file size {file_size}"], False
+        if (index_base - dir_table_offset) % 12:
+            return [f"directory table size {index_base - dir_table_offset} is not a multiple of 12"], False
+        if dir_table_size and dir_table_size != index_base - dir_table_offset:
+            problems.append(f"header dir table size {dir_table_size}, tables give {index_base - dir_table_offset}")
+        f.seek(dir_table_offset)
+        dir_table = f.read(index_base - dir_table_offset)
+
+    expected = 0
+    last_d_hash = None
+    for n, (d_hash, offset, count) in enumerate(struct.iter_unpack('<III', dir_table)):
+        if offset % 16:
+            return problems + [f"directory {d_hash:08X} index offset {offset} is not a multiple of 16"], False
+        if last_d_hash is not None and _signed_int32(d_hash) <= _signed_int32(last_d_hash):
+            problems.append(f"directory {d_hash:08X} is out of order or repeated")
+        if offset != expected * 16 or count == 0:
+            problems.append(f"directory {d_hash:08X} covers index entries {offset // 16}..{offset // 16 + count}, "
+                            f"expected them to start at {expected}")
+        expected = max(expected, offset // 16 + count)
+        last_d_hash = d_hash
+    if index_base + expected * 16 > file_size:
+        return problems + [f"index of {expected} entries runs past the end of the file"], False
+    if data_base != index_base + expected * 16:
+        problems.append(f"header data base {data_base}, index ends at {index_base + expected * 16}")
+    return problems, True
+
+def _verify_entry(archive: McpkArchive, i: int, is_mcs: bool) -> str | None:
+    # None when entry i inflates to its u_size (and decrypts and parses as a script when is_mcs)
+    data = archive._data(i)
+    u_size = archive.u_sizes[i]
+    try:
+        if u_size == 0x7FFFFFFF or len(data) == u_size:
+            # script entries and stored entries are kept as is
+            u_data = data
+        elif not is_zlib_header(data):
+            return "not a zlib stream and not stored"
+        else:
+            # inflate at most VERIFY_CHUNK_SIZE bytes at a time, only scripts
+            # that are checked further are kept
+            decompressor = zlib.decompressobj()
+            parts = [] if is_mcs else None
+            size = 0
+            for start in range(0, len(data), VERIFY_CHUNK_SIZE):
+                chunk = data[start:start + VERIFY_CHUNK_SIZE]
+                while chunk and not decompressor.eof:
+                    out = decompressor.decompress(chunk, VERIFY_CHUNK_SIZE)
+                    size += len(out)
+                    if size > u_size:
+                        return f"inflates to more than {u_size} bytes, the size in the index"
+                    if parts is not None:
+                        parts.append(out)
+                    chunk = decompressor.unconsumed_tail
+                if decompressor.eof:
+                    break
+            if not decompressor.eof:
+                return "zlib stream is truncated"
+            if size != u_size:
+                return f"inflates to {size} bytes, index says {u_size}"
+            u_data = b"".join(parts) if parts is not None else None
+        if is_mcs:
+            from mcs import decrypt_data
+            from anti_confuser import McsMarshal
+
+            with redirect_stdout(io.StringIO()):
+                d_data = decrypt_data(bytes(u_data))
+            parser = McsMarshal(d_data)
+            if not isinstance(parser.r_object(), dict) or parser.pos != parser.size:
+                return "script does not decrypt to a code object"
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+def _verify_batch(tasks: list) -> list:
+    # Worker side of verify_mcpk, shares the archive set up by _init_extract_worker
+    return [(i, _verify_entry(_worker_archive, i, is_mcs)) for i, is_mcs in tasks]
+
+def verify_mcpk(file_path: str, workers: int = None, check_mcs: bool = False) -> list:
+    """
+    Check the header offsets, the directory table, that every index entry
+    lies within the file without overlapping another (deduplicated entries
+    may share data), and that every payload inflates to its u_size. With
+    check_mcs, script entries must also decrypt and parse with McsMarshal.
+    Nothing is written; returns the problems found, empty for a good pack.
+    """
+    if not os.path.isfile(file_path):
+        print(f"[!] File {file_path} does not exist")
+        return [f"{file_path} does not exist"]
+    problems, usable = _verify_layout(file_path)
+    for problem in problems:
+        print(f"[!] {problem}")
+    if not usable:
+        return problems
+
+    def report(i, problem):
+        message = f"entry {d_hashes[i]:08X}/{archive.f_hashes[i] & 0xFFFFFFFF:08X}: {problem}"
+        problems.append(message)
+        print(f"[!] {message}")
+
+    with McpkArchive(file_path) as archive:
+        file_size = len(archive._map)
+        names = _entry_names(archive) if check_mcs else {}
+        d_hashes = {}
+        ranges = []
+        for d_hash, f_hash, i in archive._entry_keys():
+            d_hashes[i] = d_hash
+        for d, (offset, count) in enumerate(zip(archive.dir_offsets, archive.dir_counts)):
+            start = offset // 16
+            for i in range(start + 1, start + count):
+                if archive.f_hashes[i] <= archive.f_hashes[i - 1]:
+                    report(i, "file hash out of order or repeated in its directory")
+        for i in range(archive.entry_count):
+            if i not in d_hashes:
+                d_hashes[i] = 0
+                report(i, "not referenced by any directory")
+            end = archive.data_base + archive.offsets[i] + archive.c_sizes[i]
+            if end > file_size:
+                report(i, f"data ends at {end}, past the end of the file ({file_size})")
+            else:
+                ranges.append((archive.offsets[i], archive.c_sizes[i], archive.u_sizes[i], i))
+
+        ranges.sort()
+        tasks = []
+        checked = set()
+        last_end = 0
+        last_range = None
+        for offset, c_size, u_size, i in ranges:
+            if (offset, c_size) != last_range and offset < last_end:
+                report(i, f"data at {offset}..{offset + c_size} overlaps another entry")
+            last_end = max(last_end, offset + c_size)
+            last_range = (offset, c_size)
+            if (offset, c_size, u_size) in checked:
+                # deduplicated entry, its payload is checked once
+                continue
+            checked.add((offset, c_size, u_size))
+            name = names.get((d_hashes[i], archive.f_hashes[i] & 0xFFFFFFFF), "")
+            tasks.append((i, check_mcs and (u_size == 0x7FFFFFFF or name.endswith('.mcs'))))
+
+        if workers and workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_extract_worker,
+                                     initargs=(file_path,)) as pool:
+                futures = [pool.submit(_verify_batch, tasks[start:start + EXTRACT_BATCH_SIZE])
+                           for start in range(0, len(tasks), EXTRACT_BATCH_SIZE)]
+                results = [result for future in futures for result in future.result()]
+        else:
+            results = [(i, _verify_entry(archive, i, is_mcs)) for i, is_mcs in tasks]
+        for i, problem in results:
+            if problem is not None:
+                report(i, problem)
+        entry_count = archive.entry_count
+
+    if problems:
+        print(f"[!] {len(problems)} problems found in {file_path}")
+    else:
+        print(f"[+] {file_path} OK: {entry_count} entries, {len(tasks)} payloads checked")
+    return problems
+
+def _parse_hash_pair(value: str) -> tuple[int, int]:
+    try:
+        d_hash, f_hash = value.replace('/', ':').split(':')
+        return int(d_hash, 16), int(f_hash, 16)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected D_HASH:F_HASH in hex, got {value!r}")
+
+def _cli(argv: list) -> None:
+    parser = argparse.ArgumentParser(prog="mcpk.py", description="Unpack, pack and inspect MCPK archives.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_names(command):
+        command.add_argument("--hash-store", help="JSON path hash store, read and updated")
+        command.add_argument("--names", help="name dictionary built with name_dict.py")
+
+    unpack = commands.add_parser("unpack", help="extract every entry")
+    unpack.add_argument("archive")
+    unpack.add_argument("-o", "--output", help="output directory (default: <archive>_unpacked)")
+    unpack.add_argument("--workers", type=int)
+    add_names(unpack)
+
+    extract = commands.add_parser("extract", help="extract selected entries only")
+    extract.add_argument("archive")
+    extract.add_argument("paths", nargs="*", help="relative paths of entries to extract")
+    extract.add_argument("-o", "--output", help="output directory (default: <archive>_unpacked)")
+    extract.add_argument("--include", action="append", default=[], metavar="GLOB")
+    extract.add_argument("--exclude", action="append", default=[], metavar="GLOB")
+    extract.add_argument("--hash", action="append", default=[], type=_parse_hash_pair, metavar="D_HASH:F_HASH",
+                         dest="hashes")
+    extract.add_argument("--workers", type=int)
+    add_names(extract)
+
+    ls = commands.add_parser("ls", help="list entries without reading their data")
+    ls.add_argument("archive")
+    ls.add_argument("--json", action="store_true")
+    ls.add_argument("--no-contents", action="store_true", help="do not read contents.json for paths")
+    add_names(ls)
+
+    stat = commands.add_parser("stat", help="summarize the archive layout")
+    stat.add_argument("archive")
+    stat.add_argument("--json", action="store_true")
+
+    verify = commands.add_parser("verify", help="check the archive structure and every payload")
+    verify.add_argument("archive")
+    verify.add_argument("--workers", type=int, default=os.cpu_count())
+    verify.add_argument("--mcs", action="store_true", help="also decrypt and parse script entries")
+
+    pack = commands.add_parser("pack", help="pack a directory")
+    pack.add_argument("input_dir")
+    pack.add_argument("-o", "--output", help="output archive (default: <input_dir>.mcpk)")
+    pack.add_argument("--workers", type=int)
+    pack.add_argument("--threads", action="store_true", help="compress in threads instead of processes")
+    pack.add_argument("--base", help="earlier build to reuse unchanged entries from")
+    pack.add_argument("--manifest", action="store_true", help="write a manifest for later incremental packs")
+    pack.add_argument("--policy", choices=sorted(POLICIES), default="default")
+    pack.add_argument("--dedup", action="store_true", help="store identical files once")
+    pack.add_argument("--hash-store", help="JSON path hash store, read and updated")
+
+    # argparse cannot intermix the arguments of a subcommand from the main
+    # parser, so the chosen command's parser reads the rest itself
+    command = commands.choices.get(argv[0]) if argv else None
+    if command is None:
+        parser.parse_args(argv)
+    args = command.parse_intermixed_args(argv[1:], argparse.Namespace(command=argv[0]))
+    hash_store = PathHashStore(args.hash_store) if getattr(args, "hash_store", None) else None
+    if args.command == "pack":
+        output = args.output or os.path.basename(os.path.normpath(args.input_dir))
+        if not output.endswith(".mcpk"):
+            output += ".mcpk"
+        pack_mcpk(args.input_dir, output, hash_store=hash_store, workers=args.workers, threads=args.threads,
+                  base=args.base, manifest=args.manifest, policy=POLICIES[args.policy], dedup=args.dedup)
+        return
+
+    if args.command == "stat":
+        stat_mcpk(args.archive, as_json=args.json)
+        return
+    if args.command == "verify":
+        if verify_mcpk(args.archive, workers=args.workers, check_mcs=args.mcs):
+            sys.exit(1)
+        return
+
+    name_dict = NameDictionary(args.names) if args.names else None
+    try:
+        if args.command == "ls":
+            list_mcpk(args.archive, hash_store=hash_store, name_dict=name_dict, as_json=args.json,
+                      read_contents=not args.no_contents)
+            return
+        output = args.output or os.path.splitext(os.path.basename(args.archive))[0] + "_unpacked"
+        if args.command == "unpack":
+            unpack_mcpk(args.archive, output, hash_store=hash_store, name_dict=name_dict, workers=args.workers)
+        else:
+            extract_mcpk(args.archive, output, include=args.include, exclude=args.exclude, paths=args.paths,
+                         hashes=args.hashes, hash_store=hash_store, name_dict=name_dict, workers=args.workers)
+    finally:
+        if name_dict is not None:
+            name_dict.close()
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        _cli(sys.argv[1:])
+        sys.exit()
+
     print("[*] MCPK Utility")
     print("[*] 1. Unpack MCPK")
     print("[*] 2. Pack Directory to MCPK")
@@ -1,6 +1,12 @@
 import os
+import struct
+import sys
+import zlib
 
-from crypto import decrypt_data, encrypt_data
+from crypto import decrypt_data, decrypt_head, encrypt_data
+from mcs_marshal import McsMarshal
+
+PROBE_SIZE = 512
 
 def decrypt_file(filepath, output_path=None):
     if not os.path.exists(filepath):
@@ -38,8 +44,66 @@ def encrypt_file(filepath: str, output_path: str=None, content_type: int=1) -> N
         f_out.write(final_content)
     print(f"[+] Saved final data to: {output_path}")
 
+def probe_data(origin_content: bytes, budget: int = PROBE_SIZE) -> dict:
+    """
+    Identify a .mcs without decoding all of it. Returns the root tag, the
+    variant version (1-4), magic, name and filename; fields that could not
+    be read are None.
+    """
+    info = {'tag': None, 'version': None, 'magic': None, 'name': None, 'filename': None}
+    if origin_content[:2] == b'\xE5\x1F':
+        # encrypted scripts are stored reversed, so any head needs the whole
+        # stream inflated; parse all of it in one pass
+        budget = sys.maxsize
+    while True:
+        try:
+            head = decrypt_head(origin_content, budget)
+        except zlib.error as e:
+            print(f"[!] Zlib Decompression failed: {e}")
+            return info
+        if not head:
+            return info
+        partial = len(head) >= budget
+        try:
+            info.update(McsMarshal(head).r_code_header(partial=partial))
+        except (IndexError, ValueError, struct.error) as e:
+            print(f"[!] Failed to parse code object: {e}")
+            return info
+        missing = [key for key in ('name', 'filename', 'magic') if info[key] is None]
+        if info['version'] == 1:
+            # V1 code objects carry no magic
+            missing.remove('magic')
+        if not partial or info['version'] is None or not missing:
+            return info
+        budget *= 8
+
+def probe_file(filepath: str) -> None:
+    paths = []
+    if os.path.isdir(filepath):
+        for root, _, filenames in os.walk(filepath):
+            paths.extend(os.path.join(root, filename) for filename in filenames)
+    elif os.path.exists(filepath):
+        paths.append(filepath)
+    else:
+        print(f"[!] Error: File {filepath} not found.")
+        return
+
+    for path in paths:
+        with open(path, 'rb') as f:
+            origin_content = f.read()
+        if not origin_content:
+            continue
+        info = probe_data(origin_content)
+        if info['version'] is None:
+            print(f"[!] {path}: not a code object (tag {info['tag']})")
+            continue
+        filename = info['filename']
+        if isinstance(filename, bytes):
+            filename = filename.decode('utf-8', 'ignore')
+        print(f"[+] {path}: V{info['version']} tag={chr(info['tag'])} magic={info['magic']} filename={filename}")
+
 if __name__ == "__main__":
-    mode = input("[*] Select mode: [d]ecrypt or [e]ncrypt? ").strip().lower()
+    mode = input("[*] Select mode: [d]ecrypt, [e]ncrypt or [p]robe? ").strip().lower()
     if mode == 'e':
         target_file = input("[*] Enter path to .pyc file to encrypt: ").strip()
         
@@ -51,3 +115,6 @@ if __name__ == "__main__":
     elif mode == 'd':
         target_file = input("[*] Enter path to .mcs file to decrypt: ").strip()
         decrypt_file(target_file)
+    elif mode == 'p':
+        target_file = input("[*] Enter path to .mcs file or folder to probe: ").strip()
+        probe_file(target_file)
@@ -7,40 +7,335 @@ _NULL = object()
 class StopIterationException(Exception):
     pass
 
+# Keystream bytes precomputed per RC4 key, strings up to this size are
+# decrypted with a single XOR against the cached prefix
+RC4_PREFIX_SIZE = 4096
+
+def _xor_bytes(data: bytes, key: bytes) -> bytes:
+    n = len(data)
+    return (int.from_bytes(data, 'little') ^ int.from_bytes(key[:n], 'little')).to_bytes(n, 'little')
+
 class McsRC4:
+    # key -> (keystream prefix, (sbox, i, j)) with the PRGA state after the prefix
+    _states = {}
+
     def __init__(self, key: bytes):
         self.key = key
-        self.sbox = [0] * 256
-        self._ksa()
+        self.prefix, self._prefix_state = self._cached_state(key)
+        self.sbox = None
+        self.pos = 0
 
-    def _ksa(self):
-        key_len = len(self.key)
-        for i in range(256):
-            self.sbox[i] = i
+    @classmethod
+    def _cached_state(cls, key: bytes) -> tuple[bytes, tuple]:
+        state = cls._states.get(key)
+        if state is None:
+            sbox = cls._ksa(key)
+            i = j = 0
+            prefix = bytearray(RC4_PREFIX_SIZE)
+            for k in range(RC4_PREFIX_SIZE):
+                i = (i + 1) & 0xFF
+                si = sbox[i]
+                j = (j + si) & 0xFF
+                sj = sbox[j]
+                sbox[i], sbox[j] = sj, si
+                prefix[k] = sbox[(si + sj) & 0xFF]
+            state = (bytes(prefix), (tuple(sbox), i, j))
+            cls._states[key] = state
+        return state
+
+    @classmethod
+    def keystream(cls, key: bytes, n: int) -> bytes:
+        """
+        Return at least the first n keystream bytes of key.
+        """
+        prefix = cls._cached_state(key)[0]
+        if n <= len(prefix):
+            return prefix
+        return cls(key).decrypt(bytes(n))
+
+    @staticmethod
+    def _ksa(key: bytes) -> list:
+        key_len = len(key)
+        sbox = list(range(256))
         j = 0
         for i in range(256):
-            j = (j + self.sbox[i] + self.key[i % key_len]) & 0xFF
-            self.sbox[i], self.sbox[j] = self.sbox[j], self.sbox[i]
-        self.i = self.j = 0
+            j = (j + sbox[i] + key[i % key_len]) & 0xFF
+            sbox[i], sbox[j] = sbox[j], sbox[i]
+        return sbox
 
     def decrypt(self, data: bytes) -> bytes:
-        data = bytearray(data)
-        for k in range(len(data)):
-            self.i = (self.i + 1) & 0xFF
-            self.j = (self.j + self.sbox[self.i]) & 0xFF
-            self.sbox[self.i], self.sbox[self.j] = self.sbox[self.j], self.sbox[self.i]
-            t = (self.sbox[self.i] + self.sbox[self.j]) & 0xFF
-            data[k] ^= self.sbox[t]
-        return bytes(data)
+        start, end = self.pos, self.pos + len(data)
+        self.pos = end
+        if end <= RC4_PREFIX_SIZE:
+            return _xor_bytes(data, self.prefix[start:end])
+
+        # Past the prefix, continue from a clone of the state after it
+        if self.sbox is None:
+            sbox, self.i, self.j = self._prefix_state
+            self.sbox = list(sbox)
+        skip = max(RC4_PREFIX_SIZE - start, 0)
+        stream = bytearray(len(data) - skip)
+        sbox, i, j = self.sbox, self.i, self.j
+        for k in range(len(stream)):
+            i = (i + 1) & 0xFF
+            si = sbox[i]
+            j = (j + si) & 0xFF
+            sj = sbox[j]
+            sbox[i], sbox[j] = sj, si
+            stream[k] = sbox[(si + sj) & 0xFF]
+        self.i, self.j = i, j
+        return _xor_bytes(data, self.prefix[start:start + skip] + stream)
+
+_XOR_8D = bytes(b ^ 0x8D for b in range(256))
+
+_SHORT = struct.Struct('<H')
+_INT = struct.Struct('<i')
+_INT64 = struct.Struct('<q')
+_DOUBLE = struct.Struct('<d')
+
+def materialize(obj: Any) -> Any:
+    """
+    Convert the memoryview strings of a zero_copy parse into bytes.
+    """
+    if isinstance(obj, memoryview):
+        return obj.tobytes()
+    if isinstance(obj, tuple):
+        return tuple(materialize(item) for item in obj)
+    if isinstance(obj, list):
+        return [materialize(item) for item in obj]
+    if isinstance(obj, (set, frozenset)):
+        return type(obj)(materialize(item) for item in obj)
+    if isinstance(obj, dict):
+        return {materialize(k): materialize(v) for k, v in obj.items()}
+    return obj
+
+_PUSHED = object()
+_SEQ = object()
+_DICT = object()
+_CODE = object()
+
+_SEQUENCE_TYPES = {
+    40: tuple,  # '('
+    91: list,  # '['
+    60: set,  # '<'
+    62: frozenset  # '>'
+}
+
+# Field order of each code object variant, 'i' fields are raw ints
+_CODE_LAYOUTS = {
+    99: (  # 'c'
+        ('argcount', 'i'), ('nlocals', 'i'), ('stacksize', 'i'), ('flags', 'i'),
+        ('code', 'o'), ('consts', 'o'), ('names', 'o'), ('varnames', 'o'),
+        ('freevars', 'o'), ('cellvars', 'o'), ('filename', 'o'), ('name', 'o'),
+        ('firstlineno', 'i'), ('lnotab', 'o')
+    ),
+    77: (  # 'M'
+        ('argcount', 'i'), ('lnotab', 'o'), ('cellvars', 'o'), ('firstlineno', 'i'),
+        ('varnames', 'o'), ('consts', 'o'), ('name', 'o'), ('stacksize', 'i'),
+        ('freevars', 'o'), ('names', 'o'), ('code', 'o'), ('flags', 'i'),
+        ('filename', 'o'), ('nlocals', 'i'), ('magic', 'i')
+    ),
+    111: (  # 'o'
+        ('nlocals', 'i'), ('flags', 'i'), ('consts', 'o'), ('stacksize', 'i'),
+        ('varnames', 'o'), ('argcount', 'i'), ('cellvars', 'o'), ('names', 'o'),
+        ('freevars', 'o'), ('name', 'o'), ('code', 'o'), ('firstlineno', 'i'),
+        ('lnotab', 'o'), ('magic', 'i'), ('filename', 'o')
+    ),
+    97: (  # 'a'
+        ('lnotab', 'o'), ('varnames', 'o'), ('flags', 'i'), ('freevars', 'o'),
+        ('cellvars', 'o'), ('filename', 'o'), ('stacksize', 'i'), ('firstlineno', 'i'),
+        ('consts', 'o'), ('argcount', 'i'), ('code', 'o'), ('nlocals', 'i'),
+        ('name', 'o'), ('names', 'o'), ('magic', 'i')
+    )
+}
+_CODE_VERSIONS = {99: 1, 111: 2, 97: 3, 77: 4}
+
+# Payload size of tags that are skipped without reading anything
+_FIXED_SIZES = {48: 0, 78: 0, 110: 0, 84: 0, 70: 0, 46: 0, 83: 0, 73: 8, 103: 8}
+# Length prefixed strings that are not kept as references
+_SKIP_STRINGS = frozenset((115, 117, 109, 49, 23, 29, 8, 14))
+
+def _int_runs(layout: tuple) -> tuple:
+    # index -> (int fields starting there, index of the next object field)
+    runs = []
+    for index in range(len(layout) + 1):
+        end = index
+        while end < len(layout) and layout[end][1] == 'i':
+            end += 1
+        runs.append((end - index, end))
+    return tuple(runs)
+
+_CODE_INT_RUNS = {tag: _int_runs(layout) for tag, layout in _CODE_LAYOUTS.items()}
+
+# tag -> name of the McsMarshal handler used by r_object
+_HANDLER_NAMES = ['_h_unknown'] * 256
+for _tags, _name in (
+    ((48,), '_h_null'),  # '0'
+    ((78, 110), '_h_none'),  # 'N', 'n'
+    ((84,), '_h_true'),  # 'T'
+    ((70,), '_h_false'),  # 'F'
+    ((46,), '_h_ellipsis'),  # '.'
+    ((83,), '_h_stop_iteration'),  # 'S'
+    ((105,), '_h_int'),  # 'i'
+    ((73,), '_h_int64'),  # 'I'
+    ((108, 76), '_h_long'),  # 'l', 'L'
+    ((102,), '_h_float'),  # 'f'
+    ((103,), '_h_double'),  # 'g'
+    ((115,), '_h_string'),  # 's'
+    ((116,), '_h_interned'),  # 't'
+    ((117,), '_h_unicode'),  # 'u'
+    ((82,), '_h_ref'),  # 'R'
+    ((40, 91, 60, 62), '_h_sequence'),  # '(', '[', '<', '>'
+    ((123,), '_h_dict'),  # '{'
+    ((109, 49, 23, 26, 29, 98), '_h_rc4'),  # 'm', '1', 23, 26, 29, 'b'
+    ((8, 14, 15), '_h_xor'),
+    ((99, 77, 111, 97), '_h_code')  # 'c', 'M', 'o', 'a'
+):
+    for _tag in _tags:
+        _HANDLER_NAMES[_tag] = _name
+del _tags, _name, _tag
+
+class LazyCodeObject(dict):
+    """
+    Code object returned by a lazy McsMarshal parse. Int fields, 'magic' and
+    'version' are read up front, object fields are decoded from their
+    recorded offsets on first access. Every read of the dict API goes
+    through __getitem__; copy() returns a plain dict with all fields decoded.
+    """
+    def __init__(self, parser: "McsMarshal"):
+        super().__init__()
+        self._parser = parser
+        self._pending = {}
+        self._stripped = False
+
+    def _defer(self, field: str, pos: int, ref_count: int) -> None:
+        dict.__setitem__(self, field, None)
+        self._pending[field] = (pos, ref_count)
+
+    def _load(self, field: str) -> None:
+        pos, ref_count = self._pending.pop(field)
+        dict.__setitem__(self, field, self._parser._decode_at(pos, ref_count))
+
+    def _strip(self) -> None:
+        # the module's confusion object is only stripped once code, consts
+        # and names are actually needed
+        self._stripped = True
+        if 'name' in self._pending:
+            self._load('name')
+        name = dict.__getitem__(self, 'name')
+        if isinstance(name, (bytes, memoryview)):
+            name = str(name, 'utf-8', 'ignore')
+        if name != '<module>':
+            return
+        fields = {'name': name, 'version': dict.__getitem__(self, 'version')}
+        for field in ('consts', 'names', 'code'):
+            if field in self._pending:
+                self._load(field)
+            fields[field] = dict.__getitem__(self, field)
+        self._parser._strip_confusion(fields)
+        for field in ('consts', 'names', 'code'):
+            dict.__setitem__(self, field, fields[field])
+
+    def __getitem__(self, key: str) -> Any:
+        if not self._stripped and key in ('consts', 'names', 'code'):
+            self._strip()
+        if key in self._pending:
+            self._load(key)
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._pending.pop(key, None)
+        dict.__setitem__(self, key, value)
+
+    def __iter__(self):
+        # defined in Python so dict(obj), {**obj} and update() take the
+        # keys()/__getitem__ path instead of copying the raw storage
+        return iter(dict.keys(self))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    def pop(self, key: str, *default: Any) -> Any:
+        if key in self:
+            value = self[key]
+            dict.__delitem__(self, key)
+            return value
+        return dict.pop(self, key, *default)
+
+    def popitem(self) -> tuple:
+        key = next(reversed(dict.keys(self)))
+        return key, self.pop(key)
+
+    def setdefault(self, key: str, default: Any = None) -> Any:
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def copy(self) -> dict:
+        return dict(self.items())
+
+    def __or__(self, other: Any) -> dict:
+        if not isinstance(other, dict):
+            return NotImplemented
+        return self.copy() | other
+
+    def __eq__(self, other: Any) -> bool:
+        return self.copy() == other
+
+    def __ne__(self, other: Any) -> bool:
+        return not self == other
+
+    def __repr__(self) -> str:
+        return repr(self.copy())
+
+    def __reduce__(self):
+        # copy.copy and pickle get a decoded plain dict
+        return dict, (self.items(),)
+
+    __hash__ = None
 
 class McsMarshal:
     RC4_KEY_V2 = b"\xa7\x0d\x37\x7a"
     RC4_KEY_V3 = b"\x8d\x06\xe8\xc8\xb7\xd7\xb7\x28\x46\x51\xae\x04"
 
-    def __init__(self, data: bytes):
-        self.data = data
+    def __init__(self, data: bytes, zero_copy: bool = False, lazy: bool = False):
+        """
+        With zero_copy, plain strings (code, lnotab, names...) are returned as
+        memoryviews into data instead of bytes, see materialize().
+        With lazy, code objects are returned as LazyCodeObject, which only
+        decodes its object fields when they are accessed.
+        """
+        if zero_copy and not isinstance(data, bytes):
+            # views are only hashable on read-only buffers
+            data = bytes(data)
+        self.source = data
+        self.data = memoryview(data)
+        self.size = len(data)
+        self.zero_copy = zero_copy
+        self.lazy = lazy
         self.pos = 0
         self.refs = []
+        # Set when decoding a lazy field: refs already holds every reference,
+        # this counts the ones that would have been read at this point
+        self._ref_limit = None
+        self._handlers = [getattr(self, name) for name in _HANDLER_NAMES]
+        self._stack = []
+        # Every encrypted string restarts RC4, so they share one keystream per key
+        self.keystreams = {}
+
+    def rc4_decrypt(self, key: bytes, data: bytes) -> bytes:
+        stream = self.keystreams.get(key)
+        if stream is None or len(stream) < len(data):
+            size = len(data) if stream is None else max(len(data), len(stream) * 2)
+            stream = McsRC4.keystream(key, size)
+            self.keystreams[key] = stream
+        return _xor_bytes(data, stream)
 
     def r_byte(self) -> int:
         val = self.data[self.pos]
@@ -48,23 +343,23 @@ class McsMarshal:
         return val
 
     def r_short(self) -> int:
-        if self.pos + 2 > len(self.data):
+        if self.pos + 2 > self.size:
             return 0
-        v = struct.unpack('<H', self.data[self.pos:self.pos+2])[0]
+        v = _SHORT.unpack_from(self.data, self.pos)[0]
         self.pos += 2
         return v
 
     def r_int(self) -> int:
-        if self.pos + 4 > len(self.data):
+        if self.pos + 4 > self.size:
             val = 0
             for i in range(4):
-                if self.pos < len(self.data):
+                if self.pos < self.size:
                     val |= self.data[self.pos] << (i * 8)
                     self.pos += 1
                 else:
                     val |= 0xFF << (i * 8)
             return struct.unpack('<i', struct.pack('<I', val & 0xFFFFFFFF))[0]
-        val = struct.unpack('<i', self.data[self.pos:self.pos+4])[0]
+        val = _INT.unpack_from(self.data, self.pos)[0]
         self.pos += 4
         return val
 
@@ -84,13 +379,314 @@ class McsMarshal:
             size = self.r_int()
         if size < 0:
             return b""
-        if self.pos + size > len(self.data):
-            size = len(self.data) - self.pos
+        if self.pos + size > self.size:
+            size = self.size - self.pos
         res = self.data[self.pos:self.pos+size]
         self.pos += size
-        return res
+        return res if self.zero_copy else res.tobytes()
 
     def r_object(self) -> Any:
+        """
+        Read one object. Tags are dispatched through a 256-entry handler
+        table and containers are tracked on an explicit stack, so nesting
+        depth is not limited by Python's recursion limit.
+        """
+        handlers = self._handlers
+        data = self.data
+        stack = self._stack = []
+        while True:
+            tag = data[self.pos]
+            self.pos += 1
+            value = handlers[tag](tag)
+            # hand finished values to the innermost open container
+            while value is not _PUSHED:
+                if not stack:
+                    return value
+                frame = stack[-1]
+                kind = frame[0]
+                if kind is _SEQ:
+                    frame[1].append(value)
+                    frame[2] -= 1
+                    if frame[2] > 0:
+                        break
+                    stack.pop()
+                    value = frame[3](frame[1])
+                elif kind is _DICT:
+                    if frame[2] is _NULL:
+                        if value is _NULL:
+                            stack.pop()
+                            value = frame[1]
+                        else:
+                            frame[2] = value
+                            break
+                    else:
+                        frame[1][frame[2]] = value
+                        frame[2] = _NULL
+                        break
+                else:
+                    obj, layout, index, code_tag = frame[1], frame[2], frame[3], frame[4]
+                    obj[layout[index][0]] = value
+                    index = self._read_code_ints(obj, layout, index + 1)
+                    if index < len(layout):
+                        frame[3] = index
+                        break
+                    stack.pop()
+                    self._finish_code_object(obj, code_tag)
+                    value = obj
+
+    def _read_code_ints(self, obj: dict, layout: tuple, index: int) -> int:
+        # read int fields up to the next object field
+        while index < len(layout) and layout[index][1] == 'i':
+            obj[layout[index][0]] = self.r_int()
+            index += 1
+        return index
+
+    def _h_unknown(self, tag: int) -> Any:
+        raise ValueError(f"Unknown Tag: {tag} ({chr(tag) if 32 <= tag <= 126 else '?'}) at {self.pos-1}")
+
+    def _h_null(self, tag: int) -> Any:
+        return _NULL
+
+    def _h_none(self, tag: int) -> Any:
+        return None
+
+    def _h_true(self, tag: int) -> Any:
+        return True
+
+    def _h_false(self, tag: int) -> Any:
+        return False
+
+    def _h_ellipsis(self, tag: int) -> Any:
+        return Ellipsis
+
+    def _h_stop_iteration(self, tag: int) -> Any:
+        return StopIterationException
+
+    def _h_int(self, tag: int) -> Any:
+        return self.r_int()
+
+    def _h_int64(self, tag: int) -> Any:
+        v = _INT64.unpack_from(self.data, self.pos)[0]
+        self.pos += 8
+        return v
+
+    def _h_long(self, tag: int) -> Any:
+        return self.r_long()
+
+    def _h_float(self, tag: int) -> Any:
+        sz = self.r_byte()
+        return float(bytes(self.r_string(sz)))
+
+    def _h_double(self, tag: int) -> Any:
+        v = _DOUBLE.unpack_from(self.data, self.pos)[0]
+        self.pos += 8
+        return v
+
+    def _h_string(self, tag: int) -> Any:
+        return self.r_string()
+
+    def _h_interned(self, tag: int) -> Any:
+        s = self.r_string()
+        self._add_ref(s)
+        return s
+
+    def _h_unicode(self, tag: int) -> Any:
+        return str(self.r_string(), 'utf-8', 'ignore')
+
+    def _h_ref(self, tag: int) -> Any:
+        idx = self.r_int()
+        if self._ref_limit is None:
+            return self.refs[idx] if idx < len(self.refs) else None
+        if idx >= self._ref_limit:
+            return None
+        if idx < 0:
+            idx += self._ref_limit
+            if idx < 0:
+                raise IndexError("list index out of range")
+        return self.refs[idx]
+
+    def _add_ref(self, value: Any) -> None:
+        if self._ref_limit is None:
+            self.refs.append(value)
+        else:
+            self._ref_limit += 1
+
+    def _h_sequence(self, tag: int) -> Any:
+        n = self.r_int()
+        finish = _SEQUENCE_TYPES[tag]
+        if n <= 0:
+            return finish(())
+        self._stack.append([_SEQ, [], n, finish])
+        return _PUSHED
+
+    def _h_dict(self, tag: int) -> Any:
+        self._stack.append([_DICT, {}, _NULL])
+        return _PUSHED
+
+    def _h_rc4(self, tag: int) -> Any:
+        key = self.RC4_KEY_V2 if tag in (23, 26, 29) else self.RC4_KEY_V3
+        dec = self.rc4_decrypt(key, self.r_string())
+        if tag in (26, 98): # interned or common string refs
+            self._add_ref(dec)
+        if tag == 29: # unicode
+            return dec.decode('utf-8', 'ignore')
+        return dec
+
+    def _h_xor(self, tag: int) -> Any:
+        res = bytes(self.r_string()).translate(_XOR_8D)
+        if tag == 15:
+            self._add_ref(res)
+        return res
+
+    def _h_code(self, tag: int) -> Any:
+        if self.lazy:
+            return self._r_lazy_code_object(tag)
+        obj = {}
+        layout = _CODE_LAYOUTS[tag]
+        index = self._read_code_ints(obj, layout, 0)
+        self._stack.append([_CODE, obj, layout, index, tag])
+        return _PUSHED
+
+    def _r_lazy_code_object(self, tag: int) -> "LazyCodeObject":
+        obj = LazyCodeObject(self)
+        for field, kind in _CODE_LAYOUTS[tag]:
+            if kind == 'i':
+                dict.__setitem__(obj, field, self.r_int())
+            else:
+                ref_count = len(self.refs) if self._ref_limit is None else self._ref_limit
+                obj._defer(field, self.pos, ref_count)
+                self._skip_object()
+        if 'magic' not in obj:
+            dict.__setitem__(obj, 'magic', None)
+        dict.__setitem__(obj, 'version', _CODE_VERSIONS[tag])
+        return obj
+
+    def _decode_at(self, pos: int, ref_count: int) -> Any:
+        # Decode one object of a lazy code object with the references that
+        # were known when it was skipped
+        parser = McsMarshal(self.source, zero_copy=self.zero_copy, lazy=True)
+        parser.refs = self.refs
+        parser.keystreams = self.keystreams
+        parser._ref_limit = ref_count
+        parser.pos = pos
+        return parser.r_object()
+
+    def _skip_object(self) -> None:
+        """
+        Advance past one object without building it. References are still
+        recorded so later 'R' tags resolve as in a full parse.
+        """
+        data, size = self.data, self.size
+        unpack_int = _INT.unpack_from
+        pos = self.pos
+        stack = []
+        while True:
+            tag = data[pos]
+            pos += 1
+            is_null = False
+            if tag in _FIXED_SIZES:
+                pos += _FIXED_SIZES[tag]
+                is_null = tag == 48
+            elif tag in _SKIP_STRINGS or tag in (105, 82): # strings, 'i', 'R'
+                if pos + 4 > size:
+                    pos = size
+                else:
+                    n = unpack_int(data, pos)[0]
+                    pos += 4
+                    if tag in _SKIP_STRINGS and n > 0:
+                        pos = min(pos + n, size)
+            elif tag in (116, 26, 98, 15): # strings kept as references
+                self.pos = pos
+                self._handlers[tag](tag)
+                pos = self.pos
+            elif tag in (108, 76): # 'l', 'L'
+                self.pos = pos
+                n = abs(self.r_int())
+                pos = min(self.pos + 2 * n, size)
+            elif tag == 102: # 'f'
+                pos = min(pos + 1 + data[pos], size)
+            elif tag in _SEQUENCE_TYPES:
+                self.pos = pos
+                n = self.r_int()
+                pos = self.pos
+                if n > 0:
+                    stack.append([_SEQ, n])
+                    continue
+            elif tag == 123: # '{'
+                stack.append([_DICT, True])
+                continue
+            elif tag in _CODE_LAYOUTS:
+                ints, index = _CODE_INT_RUNS[tag][0]
+                pos = min(pos + 4 * ints, size)
+                stack.append([_CODE, _CODE_INT_RUNS[tag], index])
+                continue
+            else:
+                self.pos = pos
+                self._h_unknown(tag)
+
+            # one object done, update the innermost open container
+            while stack:
+                frame = stack[-1]
+                if frame[0] is _SEQ:
+                    frame[1] -= 1
+                    if frame[1] > 0:
+                        break
+                elif frame[0] is _DICT:
+                    if not frame[1] or not is_null:
+                        frame[1] = not frame[1]
+                        break
+                else:
+                    runs = frame[1]
+                    ints, index = runs[frame[2] + 1]
+                    pos = min(pos + 4 * ints, size)
+                    if index < len(runs) - 1:
+                        frame[2] = index
+                        break
+                stack.pop()
+                is_null = False
+            else:
+                self.pos = pos
+                return
+
+    def r_code_header(self, fields: tuple = ('name', 'filename'), partial: bool = False) -> dict:
+        """
+        Read the root code object only as far as needed for the given object
+        fields, skipping everything else. Returns tag, version, magic and the
+        fields found. With partial, data is treated as a prefix of the real
+        data and fields that may be cut off by its end are left out.
+        """
+        tag = self.r_byte()
+        info = {'tag': tag, 'version': _CODE_VERSIONS.get(tag), 'magic': None}
+        if tag not in _CODE_LAYOUTS:
+            return info
+        wanted = set(fields) | {'magic'}
+        try:
+            for field, kind in _CODE_LAYOUTS[tag]:
+                if not wanted:
+                    break
+                if kind == 'i':
+                    if partial and self.pos + 4 > self.size:
+                        break
+                    value = self.r_int()
+                elif field in wanted:
+                    value = self.r_object()
+                    if partial and self.pos >= self.size:
+                        break
+                else:
+                    self._skip_object()
+                    continue
+                if field in wanted:
+                    info[field] = value
+                    wanted.discard(field)
+        except (IndexError, ValueError, struct.error):
+            # a prefix can end inside an object, so the next byte read as a
+            # tag may not be one
+            if not partial:
+                raise
+        return info
+
+    def r_object_recursive(self) -> Any:
+        # Recursive reference implementation of r_object()
         tag = self.r_byte()
         
         # simple singletons and constants
@@ -111,16 +707,16 @@ class McsMarshal:
         if tag == 105: # 'i'
             return self.r_int()
         if tag == 73: # 'I' - 64-bit int
-            v = struct.unpack('<q', self.data[self.pos:self.pos+8])[0]
+            v = _INT64.unpack_from(self.data, self.pos)[0]
             self.pos += 8
             return v
         if tag in (108, 76): # 'l', 'L'
             return self.r_long()
         if tag == 102: # 'f'
             sz = self.r_byte()
-            return float(self.r_string(sz))
+            return float(bytes(self.r_string(sz)))
         if tag == 103: # 'g'
-            v = struct.unpack('<d', self.data[self.pos:self.pos+8])[0]
+            v = _DOUBLE.unpack_from(self.data, self.pos)[0]
             self.pos += 8
             return v
             
@@ -132,7 +728,7 @@ class McsMarshal:
             self.refs.append(s)
             return s
         if tag == 117: # 'u' - Unicode
-            return self.r_string().decode('utf-8', 'ignore')
+            return str(self.r_string(), 'utf-8', 'ignore')
         if tag == 82: # 'R' - Reference
             idx = self.r_int()
             return self.refs[idx] if idx < len(self.refs) else None
@@ -140,41 +736,38 @@ class McsMarshal:
         # containers
         if tag == 40: # '(' - Tuple
             n = self.r_int()
-            return tuple(self.r_object() for _ in range(n))
+            return tuple(self.r_object_recursive() for _ in range(n))
         if tag == 91: # '[' - List
             n = self.r_int()
-            return [self.r_object() for _ in range(n)]
+            return [self.r_object_recursive() for _ in range(n)]
         if tag in (60, 62): # '<', '>' - Set/FrozenSet
             n = self.r_int()
-            items = [self.r_object() for _ in range(n)]
+            items = [self.r_object_recursive() for _ in range(n)]
             return frozenset(items) if tag == 62 else set(items)
         if tag == 123: # '{' - Dict
             d = {}
             while True:
-                k = self.r_object()
+                k = self.r_object_recursive()
                 if k is _NULL:
                     break
-                d[k] = self.r_object()
+                d[k] = self.r_object_recursive()
             return d
             
         # encrypted or obfuscated types
         if tag in (109, 49, 23, 26, 29): # 'm', '1', 23, 26, 29 - RC4
             key = self.RC4_KEY_V2 if tag in (23, 26, 29) else self.RC4_KEY_V3
-            dec = McsRC4(key).decrypt(self.r_string())
+            dec = self.rc4_decrypt(key, self.r_string())
             if tag == 26: # interned or common string refs
                 self.refs.append(dec)
             if tag == 29: # unicode
                 return dec.decode('utf-8', 'ignore')
             return dec
         if tag == 98: # 'b' - RC4 with reference
-            dec = McsRC4(self.RC4_KEY_V3).decrypt(self.r_string())
+            dec = self.rc4_decrypt(self.RC4_KEY_V3, self.r_string())
             self.refs.append(dec)
             return dec
         if tag in (8, 14, 15): # XOR 0x8D 
-            raw = bytearray(self.r_string())
-            for i in range(len(raw)):
-                raw[i] ^= 0x8D
-            res = bytes(raw)
+            res = bytes(self.r_string()).translate(_XOR_8D)
             if tag == 15:
                 self.refs.append(res)
             return res
@@ -186,89 +779,24 @@ class McsMarshal:
 
     def r_code_object(self, tag: int) -> dict:
         obj = {}
-        # add an extra 'version' field to identify the mcs variant, 
+        for field, kind in _CODE_LAYOUTS[tag]:
+            obj[field] = self.r_int() if kind == 'i' else self.r_object_recursive()
+        self._finish_code_object(obj, tag)
+        return obj
+
+    def _finish_code_object(self, obj: dict, tag: int) -> None:
+        # add an extra 'version' field to identify the mcs variant,
         # not build-in r_object field
-        if tag == 99:  # 'c'
-            obj = {
-                'argcount': self.r_int(),
-                'nlocals': self.r_int(),
-                'stacksize': self.r_int(),
-                'flags': self.r_int(),
-                'code': self.r_object(),
-                'consts': self.r_object(),
-                'names': self.r_object(),
-                'varnames': self.r_object(),
-                'freevars': self.r_object(),
-                'cellvars': self.r_object(),
-                'filename': self.r_object(),
-                'name': self.r_object(),
-                'firstlineno': self.r_int(),
-                'lnotab': self.r_object(),
-                'magic': None,
-                'version': 1
-            }
-        elif tag == 77:  # 'M'
-            obj = {
-                'argcount': self.r_int(),
-                'lnotab': self.r_object(),
-                'cellvars': self.r_object(),
-                'firstlineno': self.r_int(),
-                'varnames': self.r_object(),
-                'consts': self.r_object(),
-                'name': self.r_object(),
-                'stacksize': self.r_int(),
-                'freevars': self.r_object(),
-                'names': self.r_object(),
-                'code': self.r_object(),
-                'flags': self.r_int(),
-                'filename': self.r_object(),
-                'nlocals': self.r_int(),
-                'magic': self.r_int(),
-                'version': 4
-            }
-        elif tag == 111:  # 'o'
-            obj = {
-                'nlocals': self.r_int(),
-                'flags': self.r_int(),
-                'consts': self.r_object(),
-                'stacksize': self.r_int(),
-                'varnames': self.r_object(),
-                'argcount': self.r_int(),
-                'cellvars': self.r_object(),
-                'names': self.r_object(),
-                'freevars': self.r_object(),
-                'name': self.r_object(),
-                'code': self.r_object(),
-                'firstlineno': self.r_int(),
-                'lnotab': self.r_object(),
-                'magic': self.r_int(),
-                'filename': self.r_object(),
-                'version': 2
-            }
-        elif tag == 97:  # 'a'
-            obj = {
-                'lnotab': self.r_object(),
-                'varnames': self.r_object(),
-                'flags': self.r_int(),
-                'freevars': self.r_object(),
-                'cellvars': self.r_object(),
-                'filename': self.r_object(),
-                'stacksize': self.r_int(),
-                'firstlineno': self.r_int(),
-                'consts': self.r_object(),
-                'argcount': self.r_int(),
-                'code': self.r_object(),
-                'nlocals': self.r_int(),
-                'name': self.r_object(),
-                'names': self.r_object(),
-                'magic': self.r_int(),
-                'version': 3
-            }
+        if 'magic' not in obj:
+            obj['magic'] = None
+        obj['version'] = _CODE_VERSIONS[tag]
+        self._strip_confusion(obj)
 
+    def _strip_confusion(self, obj: dict) -> None:
         # Identify and skip the trailing confusion code object in the root module
         name = obj.get('name')
-        if isinstance(name, bytes):
-            name = name.decode('utf-8', 'ignore')
+        if isinstance(name, (bytes, memoryview)):
+            name = str(name, 'utf-8', 'ignore')
 
         version = obj.get('version', 0)
         
@@ -311,8 +839,8 @@ class McsMarshal:
                             consts[none_const_idx] is None):
                             
                             conf_name = names[conf_name_idx]
-                            if isinstance(conf_name, bytes):
-                                conf_name = conf_name.decode('utf-8', 'ignore')
+                            if isinstance(conf_name, (bytes, memoryview)):
+                                conf_name = str(conf_name, 'utf-8', 'ignore')
                             
                             # Garbage name patterns: original_name + random_suffix
                             garbage_suffixes = [
@@ -340,4 +868,3 @@ class McsMarshal:
                             # 3. Patch code: strip the 9 bytes of confusion instructions
                             new_code = bytearray(code)
                             obj['code'] = bytes(new_code[:-13] + new_code[-4:])
-        return obj
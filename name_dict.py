@@ -0,0 +1,194 @@
+import json
+import mmap
+import os
+import struct
+import sys
+
+# File layout: header, directory slots, file name slots, utf-8 string blob.
+# Slots are open addressed hash tables of (hash, string offset, string length),
+# a zero length marks an empty slot.
+NAME_DICT_MAGIC = b'MCND'
+NAME_DICT_VERSION = 1
+_HEADER = struct.Struct('<4sIII')
+_SLOT = struct.Struct('<III')
+
+def _slot_count(n: int) -> int:
+    # keep the tables at most half full
+    size = 1
+    while size < n * 2:
+        size <<= 1
+    return size
+
+def _probe(h: int, mask: int) -> int:
+    return ((h * 0x9E3779B1) >> 7) & mask
+
+class NameDictionary:
+    """
+    Reverse lookup of MCPK directory and file name hashes, read through mmap.
+    Directory and file names are stored separately, so a path is recovered
+    whenever both of its parts were seen, even in different packs.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, dir_slots, file_slots = _HEADER.unpack_from(self._map, 0)
+        if magic != NAME_DICT_MAGIC or version != NAME_DICT_VERSION:
+            self.close()
+            raise ValueError(f"{path} is not a name dictionary")
+        self._dir_table = (_HEADER.size, dir_slots)
+        self._file_table = (_HEADER.size + dir_slots * _SLOT.size, file_slots)
+
+    def _lookup(self, table: tuple, h: int) -> str | None:
+        base, slots = table
+        if not slots:
+            return None
+        mask = slots - 1
+        i = _probe(h, mask)
+        while True:
+            slot_hash, offset, length = _SLOT.unpack_from(self._map, base + i * _SLOT.size)
+            if length == 0:
+                return None
+            if slot_hash == h:
+                return self._map[offset:offset + length].decode('utf-8')
+            i = (i + 1) & mask
+
+    def lookup_dir(self, d_hash: int) -> str | None:
+        if d_hash == 0:
+            return ""
+        return self._lookup(self._dir_table, d_hash)
+
+    def lookup_file(self, f_hash: int) -> str | None:
+        return self._lookup(self._file_table, f_hash)
+
+    def lookup(self, d_hash: int, f_hash: int) -> str | None:
+        directory = self.lookup_dir(d_hash)
+        if directory is None:
+            return None
+        name = self.lookup_file(f_hash)
+        if name is None:
+            return None
+        return f"{directory}/{name}" if directory else name
+
+    def _entries(self, table: tuple):
+        base, slots = table
+        for i in range(slots):
+            h, offset, length = _SLOT.unpack_from(self._map, base + i * _SLOT.size)
+            if length:
+                yield h, self._map[offset:offset + length].decode('utf-8')
+
+    def close(self) -> None:
+        if getattr(self, '_map', None) is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class NameDictionaryBuilder:
+    def __init__(self):
+        self.dirs = {}
+        self.files = {}
+
+    def add_path(self, rel_path: str) -> None:
+        from mcpk import _hash_directory, _hash_file
+
+        parts = rel_path.replace('\\', '/').strip('/').split('/')
+        try:
+            for i in range(1, len(parts)):
+                directory = '/'.join(parts[:i])
+                self.dirs.setdefault(_hash_directory(directory + '/'), directory)
+            if parts[-1]:
+                self.files.setdefault(_hash_file(parts[-1]), parts[-1])
+        except UnicodeEncodeError:
+            # MCPK hashes ascii paths only
+            pass
+
+    def add_tree(self, root: str) -> None:
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                self.add_path(os.path.relpath(os.path.join(dirpath, filename), root))
+
+    def add_contents_json(self, path: str) -> None:
+        with open(path, 'rb') as f:
+            data = json.loads(f.read().decode('utf-8'))
+        items = data.get("content", data) if isinstance(data, dict) else data
+        for item in items:
+            if isinstance(item, dict) and item.get("path"):
+                self.add_path(item["path"])
+
+    def add_name_list(self, path: str) -> None:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    self.add_path(line)
+
+    def add_dictionary(self, dictionary: NameDictionary) -> None:
+        for h, directory in dictionary._entries(dictionary._dir_table):
+            self.dirs.setdefault(h, directory)
+        for h, name in dictionary._entries(dictionary._file_table):
+            self.files.setdefault(h, name)
+
+    def add(self, source: str) -> None:
+        if os.path.isdir(source):
+            self.add_tree(source)
+        elif os.path.basename(source) == "contents.json":
+            self.add_contents_json(source)
+        else:
+            with open(source, 'rb') as f:
+                is_dict = f.read(4) == NAME_DICT_MAGIC
+            if is_dict:
+                with NameDictionary(source) as dictionary:
+                    self.add_dictionary(dictionary)
+            else:
+                self.add_name_list(source)
+
+    def write(self, path: str) -> None:
+        dir_slots, file_slots = _slot_count(len(self.dirs)), _slot_count(len(self.files))
+        blob = bytearray()
+        blob_base = _HEADER.size + (dir_slots + file_slots) * _SLOT.size
+        tables = bytearray()
+        for names, slots in ((self.dirs, dir_slots), (self.files, file_slots)):
+            table = [(0, 0, 0)] * slots
+            mask = slots - 1
+            for h, name in names.items():
+                i = _probe(h, mask)
+                while table[i][2]:
+                    i = (i + 1) & mask
+                encoded = name.encode('utf-8')
+                table[i] = (h, blob_base + len(blob), len(encoded))
+                blob += encoded
+            for slot in table:
+                tables += _SLOT.pack(*slot)
+        with open(path, 'wb') as f:
+            f.write(_HEADER.pack(NAME_DICT_MAGIC, NAME_DICT_VERSION, dir_slots, file_slots))
+            f.write(tables)
+            f.write(blob)
+
+def build_name_dictionary(output: str, sources: list) -> None:
+    builder = NameDictionaryBuilder()
+    if os.path.isfile(output):
+        # extend an existing dictionary
+        builder.add(output)
+    for source in sources:
+        if not os.path.exists(source):
+            print(f"[!] {source} not found, skipping")
+            continue
+        builder.add(source)
+    builder.write(output)
+    print(f"[+] Wrote {len(builder.dirs)} directories and {len(builder.files)} file names to {output}")
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 4 and sys.argv[1] == "build":
+        build_name_dictionary(sys.argv[2], sys.argv[3:])
+    elif len(sys.argv) == 5 and sys.argv[1] == "lookup":
+        with NameDictionary(sys.argv[2]) as dictionary:
+            print(dictionary.lookup(int(sys.argv[3], 16), int(sys.argv[4], 16)))
+    else:
+        print("Usage: python name_dict.py build <dictionary> <unpacked_dir|contents.json|name_list|dictionary> [...]")
+        print("       python name_dict.py lookup <dictionary> <d_hash> <f_hash>")
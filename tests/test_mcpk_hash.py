@@ -0,0 +1,91 @@
+import random
+
+import pytest
+
+from mcpk import (CONTENTS_JSON_HASH, REDIRECT_MCS_HASH, _hash_directory, _hash_directory_reference, _hash_file,
+                  _hash_file_reference, hash_paths)
+
+# (path, directory hash, file name hash), produced by the original implementation
+PATH_VECTORS = [
+    ("contents.json", 0x00000000, 0x33340C73),
+    ("redirect.mcs", 0x00000000, 0x8D7BFDC9),
+    ("a", 0x00000000, 0x9BEF998D),
+    ("abc", 0x00000000, 0x10E668B5),
+    ("abcd", 0x00000000, 0xBFDBDC66),
+    ("abcde", 0x00000000, 0x94BDF716),
+    ("a/b", 0x9BEF998D, 0x8A2CEEAA),
+    ("/a", 0x00000000, 0x9BEF998D),
+    ("abcd/efgh/x", 0x9FFAE02D, 0xADF4EAF4),
+    ("textures/blocks/stone.png", 0x52554634, 0x59E67263),
+    ("entities/zombie.json", 0x1A3BE962, 0x25805FB9),
+    ("sounds/music/game/creative.ogg", 0x12109B4D, 0x86BCBFD0),
+]
+
+# file name hashes of raw names, hashing stops at the first NUL
+FILE_VECTORS = [
+    (b"", 0x514FF88F),
+    (b"\x00abc", 0x514FF88F),
+    (b"abc\x00zz", 0x10E668B5),
+    (b"abcd\x00", 0xE587A85A),
+    (b"abcdefgh\x00", 0xB6B63250),
+    (b"textures/blocks/stone.png", 0x0484241C),
+]
+
+@pytest.mark.parametrize("path, d_hash, f_hash", PATH_VECTORS)
+def test_path_vectors(path, d_hash, f_hash):
+    name = path.rsplit('/', 1)[-1]
+    assert _hash_directory(path) == d_hash
+    assert _hash_file(name) == f_hash
+    assert _hash_directory(path.encode('ascii')) == d_hash
+    assert _hash_file(name.encode('ascii')) == f_hash
+    assert _hash_directory(bytearray(path.encode('ascii'))) == d_hash
+    assert _hash_file(memoryview(name.encode('ascii'))) == f_hash
+    assert hash_paths([path]) == [(d_hash, f_hash)]
+
+@pytest.mark.parametrize("name, f_hash", FILE_VECTORS)
+def test_file_vectors(name, f_hash):
+    assert _hash_file(name) == f_hash
+    assert _hash_file_reference(name) == f_hash
+
+def test_constants():
+    assert CONTENTS_JSON_HASH == 0x33340C73
+    assert REDIRECT_MCS_HASH == 0x8D7BFDC9
+
+def _edge_cases() -> list:
+    cases = [b"", b"/", b"//", b"a", b"a/", b"/a", b"\x00", b"a\x00", b"\x00/a", b"a/\x00b", b"a//b"]
+    # names and directories ending on and around the 4 byte chunk boundaries
+    for n in range(1, 18):
+        cases.append(b"x" * n)
+        cases.append(b"d" * n + b"/" + b"f" * n)
+        cases.append(b"f" * n + b"\x00")
+        cases.append(b"f" * n + b"\x00tail")
+    # the rotation repeats every 32 chunks
+    cases.append(b"y" * (4 * 32 + 3) + b"/" + b"z" * (4 * 33))
+    return cases
+
+def _random_cases(count: int, seed: int) -> list:
+    rng = random.Random(seed)
+    cases = []
+    for _ in range(count):
+        n = rng.randint(0, 150)
+        cases.append(bytes(rng.choice(b"abcdefghij/._-0123456789\x00" if rng.random() < 0.1 else b"abcdefghij/._0123")
+                           for _ in range(n)))
+    return cases
+
+@pytest.mark.parametrize("data", _edge_cases() + _random_cases(2000, 1))
+def test_matches_reference(data):
+    assert _hash_directory(data) == _hash_directory_reference(data)
+    assert _hash_file(data) == _hash_file_reference(data)
+
+def test_hash_paths_matches_reference():
+    paths = [case.decode('ascii') for case in _edge_cases() + _random_cases(2000, 2) if b"\x00" not in case]
+    # repeated paths go through the per-call caches
+    paths += paths[:100]
+    expected = [(_hash_directory_reference(path), _hash_file_reference(path.rsplit('/', 1)[-1])) for path in paths]
+    assert hash_paths(paths) == expected
+    assert hash_paths([path.encode('ascii') for path in paths]) == expected
+
+def test_hash_paths_with_nul():
+    paths = [case for case in _edge_cases() + _random_cases(500, 3) if b"\x00" in case]
+    expected = [(_hash_directory_reference(path), _hash_file_reference(path.rsplit(b'/', 1)[-1])) for path in paths]
+    assert hash_paths(paths) == expected
@@ -0,0 +1,168 @@
+import random
+
+import pytest
+
+import nls_cipher
+from nls_cipher import DEFAULT_SEED, NlsCipher
+
+SEEDS = [DEFAULT_SEED, b"\x00\x00\x00\x00\x00\x00", b"\xFF\xFF\x01\x80\x7F\x00", b"\x12\x34\x56\x78\x9A\xBC"]
+LENGTHS = [0, 1, 255, 256, 257, 4099]
+
+def _data(n: int, seed: int = 0) -> bytes:
+    return random.Random(seed).randbytes(n)
+
+@pytest.fixture
+def small_limits(monkeypatch, tmp_path):
+    # Fresh schedules with a tiny keystream cache, so checkpoints and
+    # on-the-fly masks are exercised on short inputs
+    monkeypatch.setattr(nls_cipher, "KEYSTREAM_CACHE_LIMIT", 1 << 10)
+    monkeypatch.setattr(nls_cipher, "CHECKPOINT_INTERVAL", 1 << 8)
+    monkeypatch.setattr(nls_cipher, "CHECKPOINT_CACHE", str(tmp_path / "checkpoints.json"))
+    monkeypatch.setattr(nls_cipher, "_schedules", {})
+    monkeypatch.setattr(nls_cipher, "_cached_checkpoints", {})
+    monkeypatch.setattr(nls_cipher, "_loaded_caches", set())
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("n", LENGTHS)
+def test_matches_reference(seed, n):
+    cipher = NlsCipher(seed)
+    data = _data(n, n)
+    assert cipher.decrypt(data) == cipher._decrypt_reference(data)
+    assert cipher.encrypt(data) == cipher._encrypt_reference(data)
+    assert cipher.decrypt(cipher.encrypt(data)) == data
+
+@pytest.mark.parametrize("seed", SEEDS)
+def test_past_cache_limit(small_limits, seed):
+    cipher = NlsCipher(seed)
+    data = _data(5000, 1)
+    expected = cipher._decrypt_reference(data)
+    assert cipher.decrypt(data) == expected
+    assert cipher.encrypt(data) == cipher._encrypt_reference(data)
+    # again, now from the remembered checkpoints
+    assert cipher.decrypt(data) == expected
+
+@pytest.mark.parametrize("limits", [False, True])
+@pytest.mark.parametrize("seed", SEEDS[:2])
+def test_offset(request, limits, seed):
+    if limits:
+        request.getfixturevalue("small_limits")
+    cipher = NlsCipher(seed)
+    data = _data(5000, 2)
+    expected = cipher._decrypt_reference(data)
+    encrypted = cipher._encrypt_reference(data)
+    rng = random.Random(3)
+    for _ in range(20):
+        start = rng.randrange(len(data))
+        end = rng.randrange(start, len(data) + 1)
+        assert cipher.decrypt(data[start:end], offset=start) == expected[start:end]
+        assert cipher.encrypt(data[start:end], offset=start) == encrypted[start:end]
+
+@pytest.mark.parametrize("limits", [False, True])
+@pytest.mark.parametrize("seed", SEEDS[:2])
+def test_stream_chunking(request, limits, seed):
+    if limits:
+        request.getfixturevalue("small_limits")
+    cipher = NlsCipher(seed)
+    data = _data(5000, 4)
+    rng = random.Random(5)
+    for make, reference in ((cipher.decryptor, cipher._decrypt_reference), (cipher.encryptor, cipher._encrypt_reference)):
+        stream = make()
+        out = bytearray()
+        pos = 0
+        while pos < len(data):
+            n = rng.choice([0, 1, 7, 255, 256, rng.randrange(1, 2000)])
+            out += stream.update(data[pos:pos + n])
+            pos += n
+        out += stream.finalize()
+        assert bytes(out) == reference(data)
+        with pytest.raises(ValueError):
+            stream.update(b"x")
+
+@pytest.mark.parametrize("limits", [False, True])
+def test_stream_seek(request, limits):
+    if limits:
+        request.getfixturevalue("small_limits")
+    cipher = NlsCipher(DEFAULT_SEED)
+    data = _data(5000, 6)
+    expected = cipher._decrypt_reference(data)
+    stream = cipher.decryptor()
+    rng = random.Random(7)
+    for _ in range(20):
+        start = rng.randrange(len(data))
+        end = min(len(data), start + rng.randrange(1, 1500))
+        stream.seek(start)
+        assert stream.update(data[start:end]) == expected[start:end]
+    with pytest.raises(ValueError):
+        stream.seek(-1)
+
+def test_parallel_matches_reference(small_limits, monkeypatch):
+    monkeypatch.setattr(nls_cipher, "PARALLEL_THRESHOLD", 1 << 11)
+    cipher = NlsCipher(DEFAULT_SEED)
+    data = _data(5000, 8)
+    assert cipher.decrypt_parallel(data, workers=2) == cipher._decrypt_reference(data)
+
+def test_checkpoint_cache(small_limits, monkeypatch):
+    monkeypatch.setattr(nls_cipher, "PARALLEL_THRESHOLD", 1 << 11)
+    cipher = NlsCipher(DEFAULT_SEED)
+    data = _data(5000, 9)
+    expected = cipher._decrypt_reference(data)
+    nls_cipher.precompute_checkpoints(len(data))
+    saved = dict(cipher.schedule._checkpoints)
+    assert saved
+
+    # a new process: cached states are loaded on first use, unverified
+    nls_cipher._schedules.clear()
+    cipher = NlsCipher(DEFAULT_SEED)
+    assert cipher.schedule._checkpoints == {}
+    assert cipher.decrypt_parallel(data, workers=2) == expected
+    assert cipher.schedule._loaded_checkpoints
+    # the shard starts were confirmed by the shards before them
+    assert cipher.schedule._checkpoints
+    assert cipher.schedule._checkpoints.items() <= saved.items()
+    # serial offsets only start from verified states
+    assert cipher.decrypt(data[3000:], offset=3000) == expected[3000:]
+
+def test_checkpoint_cache_stale_states(small_limits, monkeypatch):
+    monkeypatch.setattr(nls_cipher, "PARALLEL_THRESHOLD", 1 << 11)
+    cipher = NlsCipher(DEFAULT_SEED)
+    data = _data(5000, 10)
+    expected = cipher._decrypt_reference(data)
+    nls_cipher.precompute_checkpoints(len(data))
+    saved = dict(cipher.schedule._checkpoints)
+    with open(nls_cipher.CHECKPOINT_CACHE, "w") as f:
+        f.write('{"98845d9a9e8b": {%s}}' % ", ".join(
+            f'"{offset}": [1, 2, 3, 4, 5, 6]' for offset in saved))
+
+    nls_cipher._schedules.clear()
+    cipher = NlsCipher(DEFAULT_SEED)
+    for workers in (2, 3):
+        assert cipher.decrypt_parallel(data, workers=workers) == expected
+    # the corrected states replace the stale ones in the cache
+    assert cipher.schedule._checkpoints.items() <= saved.items()
+    assert nls_cipher._read_checkpoints(nls_cipher.CHECKPOINT_CACHE)[DEFAULT_SEED].items() >= \
+        cipher.schedule._checkpoints.items()
+
+def test_checkpoint_cache_off(small_limits, monkeypatch, tmp_path):
+    monkeypatch.setattr(nls_cipher, "PARALLEL_THRESHOLD", 1 << 11)
+    monkeypatch.setattr(nls_cipher, "CHECKPOINT_CACHE", "")
+    cipher = NlsCipher(DEFAULT_SEED)
+    data = _data(5000, 11)
+    assert cipher.decrypt_parallel(data, workers=2) == cipher._decrypt_reference(data)
+    assert list(tmp_path.iterdir()) == []
+    # an explicit path turns it on for one call
+    path = tmp_path / "explicit.json"
+    nls_cipher._schedules.clear()
+    cipher = NlsCipher(DEFAULT_SEED)
+    cipher.decrypt_parallel(data, workers=2, checkpoint_cache=str(path))
+    assert DEFAULT_SEED in nls_cipher._read_checkpoints(str(path))
+
+def test_checkpoint_cache_ignores_bad_files(small_limits):
+    with open(nls_cipher.CHECKPOINT_CACHE, "w") as f:
+        f.write('{"98845d9a9e8b": {"1280": [1, 2, 300, 4, 5, 6]}, "zz": {}}')
+    nls_cipher.load_checkpoints()
+    cipher = NlsCipher(DEFAULT_SEED)
+    assert cipher.schedule._loaded_checkpoints == {}
+    with open(nls_cipher.CHECKPOINT_CACHE, "w") as f:
+        f.write("not json")
+    nls_cipher.load_checkpoints()
+    nls_cipher.save_checkpoints()